@@ -0,0 +1,335 @@
+import argparse
+import multiprocessing as mp
+import queue
+import importlib
+from configparser import ConfigParser
+import os
+from glob import glob
+from time import perf_counter
+import numpy as np
+import cv2
+
+SELFDIR = os.path.abspath(f'{__file__}/..')
+
+import detectors
+import export
+
+
+def loadframes(directory:str, limit:int=20):
+    """Load sample frames for the benchmarks
+
+    Args:
+        directory (str): Directory with the images.
+        limit (int, optional): Maximum number of images. Defaults to 20.
+
+    Returns:
+        list: Frames as BGR arrays
+    """
+    paths = sorted(glob(f"{directory}/*.jpg") + glob(f"{directory}/*.png"))[:limit]
+    return [frame for path in paths if (frame := cv2.imread(path)) is not None]
+
+def timeit(fn, frames:list, repeat:int=10):
+    """Time a function over the frames
+
+    Args:
+        fn (Callable): Function called with every frame.
+        frames (list): Frames.
+        repeat (int, optional): Number of passes over the frames. Defaults to 10.
+
+    Returns:
+        tuple: Median and 95th percentile in milliseconds per frame
+    """
+    fn(frames[0])
+    times = []
+    for _ in range(repeat):
+        for frame in frames:
+            start = perf_counter()
+            fn(frame)
+            times.append((perf_counter() - start) * 1000)
+    return tuple(np.percentile(times, [50, 95]))
+
+def legacy_preprocess(img:np.ndarray):
+    """Preprocessing of LiteDetector before the preallocated input buffer, kept as the benchmark baseline
+
+    Args:
+        img (np.ndarray): Frame.
+
+    Returns:
+        tensor: Input tensor
+    """
+    from tensorflow import convert_to_tensor, newaxis
+    img = cv2.resize(img, (640, 640))
+    image_np = np.array(img)
+    image_np = (image_np / 255).astype(np.float32)
+    input_tensor = convert_to_tensor(image_np)
+    return input_tensor[newaxis, ...]
+
+def preprocess(frames:list, repeat:int=10):
+    """Compare the per frame preprocessing time of the legacy path and the preallocated buffer path
+
+    Args:
+        frames (list): Sample frames.
+        repeat (int, optional): Number of passes over the frames. Defaults to 10.
+    """
+    out = np.empty((1, 640, 640, 3), dtype=np.float32)
+    resized = np.empty((640, 640, 3), dtype=np.uint8)
+    before = timeit(legacy_preprocess, frames, repeat)
+    after = timeit(lambda frame: detectors.preprocess(frame, out[0], resized), frames, repeat)
+    print(f"{'preprocessing':<28}{'p50 ms':>10}{'p95 ms':>10}")
+    print(f"{'legacy (tf tensor)':<28}{before[0]:>10.2f}{before[1]:>10.2f}")
+    print(f"{'preallocated buffer':<28}{after[0]:>10.2f}{after[1]:>10.2f}")
+
+def _tuneworker(model:str, num_threads:int, delegate:str, frames:list, repeat:int, barrier, results):
+    """Process target of 'tune', detects the frames like a worker once all processes loaded the model"""
+    try:
+        detector = detectors.LiteDetector(model, num_threads=num_threads, delegate=delegate)
+        detector(frames[0])
+        barrier.wait()
+        times = []
+        start = perf_counter()
+        for _ in range(repeat):
+            for frame in frames:
+                begin = perf_counter()
+                detector(frame)
+                times.append((perf_counter() - begin) * 1000)
+        results.put((perf_counter() - start, times))
+    except Exception as e:
+        # the other processes stop waiting for this one
+        barrier.abort()
+        results.put(e)
+
+def tune(frames:list, model:str, num_workers:int, repeat:int=3, delegates:tuple=('xnnpack', 'none'), timeout:float=600):
+    """Benchmark interpreter thread counts and delegates with 'num_workers' workers detecting at the same time
+
+    Args:
+        frames (list): Sample frames.
+        model (str): Path of the lite model.
+        num_workers (int): Number of concurrent workers.
+        repeat (int, optional): Passes over the sample frames per worker. Defaults to 3.
+        delegates (tuple, optional): Delegates to try. Defaults to ('xnnpack', 'none').
+        timeout (float, optional): Seconds to wait for the workers of one setting, a setting whose workers fail or time out is skipped. Defaults to 600.
+
+    Returns:
+        tuple: (threads, delegate) with the highest total throughput, None if every setting failed
+    """
+    cores = os.cpu_count() or 1
+    candidates = sorted({1, max(1, cores // num_workers), cores} | {2 ** i for i in range(cores.bit_length()) if 2 ** i <= cores})
+    print(f"{num_workers} worker(s) on {cores} core(s)")
+    print(f"{'delegate':<12}{'threads':>8}{'frames/s':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    best, bestfps = None, 0.0
+    for delegate in delegates:
+        for threads in candidates:
+            barrier = mp.Barrier(num_workers)
+            results = mp.Queue()
+            processes = [mp.Process(target=_tuneworker, args=(model, threads, delegate, frames, repeat, barrier, results)) for _ in range(num_workers)]
+            for process in processes:
+                process.start()
+            measured = []
+            end = perf_counter() + timeout
+            try:
+                for _ in processes:
+                    measured.append(results.get(timeout=max(0.0, end - perf_counter())))
+            except queue.Empty:
+                barrier.abort()
+                measured.append(TimeoutError(f"no result within {timeout:.0f} s"))
+            for process in processes:
+                process.join(1)
+                if process.is_alive():
+                    process.terminate()
+            if errors := [result for result in measured if isinstance(result, Exception)]:
+                print(f"{delegate:<12}{threads:>8}  failed: {errors[0]!r}")
+                continue
+            times = [t for _, worker in measured for t in worker]
+            fps = len(times) / max(elapsed for elapsed, _ in measured)
+            p50, p95 = np.percentile(times, [50, 95])
+            print(f"{delegate:<12}{threads:>8}{fps:>10.1f}{p50:>10.1f}{p95:>10.1f}")
+            if fps > bestfps:
+                best, bestfps = (threads, delegate), fps
+    return best
+
+def backends(frames:list, directory:str, repeat:int=10, batch_size:int=4, num_threads:int=None):
+    """Compare the detector backends on the same frames, backends which are not installed or have no model are skipped
+
+    Args:
+        frames (list): Sample frames.
+        directory (str): Model directory.
+        repeat (int, optional): Number of passes over the frames. Defaults to 10.
+        batch_size (int, optional): Batch size of the throughput measurement. Defaults to 4.
+        num_threads (int, optional): Threads of the backend runtimes. Defaults to None.
+    """
+    print(f"{'backend':<10}{'load s':>8}{'p50 ms':>10}{'p95 ms':>10}{'batch frames/s':>16}")
+    for name, backend in detectors.BACKENDS.items():
+        path = backend.modelpath(directory)
+        if not backend.installed() or not os.path.exists(path):
+            print(f"{name:<10}skipped, {'runtime not installed' if not backend.installed() else f'no model at {path}'}")
+            continue
+        start = perf_counter()
+        detector = backend(path, num_threads=num_threads)
+        load = perf_counter() - start
+        p50, p95 = timeit(detector, frames, repeat)
+        batches = [frames[i:i + batch_size] for i in range(0, len(frames), batch_size)]
+        detector.batch(batches[0])
+        start = perf_counter()
+        for _ in range(repeat):
+            for batch in batches:
+                detector.batch(batch)
+        fps = repeat * len(frames) / (perf_counter() - start)
+        print(f"{name:<10}{load:>8.2f}{p50:>10.2f}{p95:>10.2f}{fps:>16.1f}")
+
+def _rss():
+    """Resident set size of the current process in MB, psutil is used if it is installed"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2 ** 20
+    except ImportError:
+        import resource
+        # peak instead of current size, in KB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+# modules imported by every process role, 'worker' also loads its models
+ROLES = {'python':(), 'capture':('camera',), 'worker':('worker',), 'manager':('manager',)}
+
+def _startuprole(role:str, model_type:str, results):
+    """Process target of 'startup', imports the modules of a process role and loads the worker models"""
+    try:
+        base = _rss()
+        start = perf_counter()
+        modules = [importlib.import_module(name) for name in ROLES[role]]
+        imported = perf_counter() - start
+        loaded = 0.0
+        if role == 'worker':
+            start = perf_counter()
+            modules[0].create_recognizer()
+            detectors.create(model_type, f"{SELFDIR}/saved_model")
+            loaded = perf_counter() - start
+        results.put((imported, loaded, base, _rss()))
+    except Exception as e:
+        results.put(e)
+
+def startup(model_type:str='lite'):
+    """Measure the import time, model load time and memory of every process role in a fresh interpreter
+
+    Args:
+        model_type (str, optional): Detector backend loaded by the worker role. Defaults to 'lite'.
+    """
+    # spawned processes start from a fresh interpreter instead of inheriting this one
+    context = mp.get_context('spawn')
+    print(f"{'role':<10}{'import s':>10}{'load s':>10}{'RSS MB':>10}{'+ MB':>10}")
+    for role in ROLES:
+        results = context.Queue()
+        process = context.Process(target=_startuprole, args=(role, model_type, results))
+        process.start()
+        result = results.get()
+        process.join()
+        if isinstance(result, Exception):
+            print(f"{role:<10}failed: {result!r}")
+            continue
+        imported, loaded, base, rss = result
+        print(f"{role:<10}{imported:>10.2f}{loaded:>10.2f}{rss:>10.0f}{rss - base:>10.0f}")
+
+def editdistance(a:str, b:str):
+    """Levenshtein distance of two strings
+
+    Args:
+        a (str): First string.
+        b (str): Second string.
+
+    Returns:
+        int: Minimum number of inserted, deleted and substituted characters
+    """
+    row = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        previous, row[0] = row[0], i
+        for j, y in enumerate(b, 1):
+            previous, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, previous + (x != y))
+    return row[-1]
+
+def recognizers(plates:list, cfg:dict, repeat:int=3, batch_size:int=6, subset:str='all'):
+    """Compare the recognizer backends on labelled plate crops, backends which are not installed or fail to load are skipped
+
+    Args:
+        plates (list): (crop, label) pairs, see export.loadplates.
+        cfg (dict): GENERAL config section with the recognizer settings, see worker.OcrConfig.fromcfg. Every registered backend is compared.
+        repeat (int, optional): Number of timed passes over the crops. Defaults to 3.
+        batch_size (int, optional): Crops per call of the throughput measurement. Defaults to 6.
+        subset (str, optional): Which set of export.splitplates the plates are, printed with the results. Defaults to 'all'.
+    """
+    # the worker module is only imported for this benchmark, it pulls in the GUI and OCR dependencies
+    import worker
+    from dataclasses import replace
+    config = worker.OcrConfig.fromcfg(cfg)
+    crops = [crop for crop, _ in plates]
+    print(f"{len(plates)} labelled crop(s) of the {subset} set")
+    print(f"{'recognizer':<12}{'load s':>8}{'char acc':>10}{'exact':>8}{'p50 ms':>10}{'p95 ms':>10}{'batch crops/s':>15}")
+    for name, backend in worker.RECOGNIZERS.items():
+        if not backend.installed():
+            print(f"{name:<12}skipped, runtime not installed")
+            continue
+        start = perf_counter()
+        try:
+            recognizer = backend(replace(config, recognizer=name))
+        except Exception as e:
+            print(f"{name:<12}skipped, loading failed: {e!r}")
+            continue
+        load = perf_counter() - start
+        recognizer.warmup()
+        texts = [''.join(text for _, (text, _) in result).upper() for result in recognizer.read(crops)]
+        errors = sum(editdistance(text, label) for text, (_, label) in zip(texts, plates))
+        accuracy = max(0.0, 1 - errors / sum(len(label) for _, label in plates))
+        exact = np.mean([text == label for text, (_, label) in zip(texts, plates)])
+        p50, p95 = timeit(lambda crop: recognizer.read([crop]), crops, repeat)
+        batches = [crops[i:i + batch_size] for i in range(0, len(crops), batch_size)]
+        start = perf_counter()
+        for _ in range(repeat):
+            for batch in batches:
+                recognizer.read(batch)
+        cps = repeat * len(crops) / (perf_counter() - start)
+        print(f"{name:<12}{load:>8.2f}{accuracy:>10.3f}{exact:>8.3f}{p50:>10.2f}{p95:>10.2f}{cps:>15.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the licence plate detection pipeline")
+    parser.add_argument('benchmark', choices=['preprocess', 'tune', 'backends', 'startup', 'recognizers'], help="Benchmark to run. 'tune' writes the fastest interpreter setting to the config.")
+    parser.add_argument('--images', default=f"{SELFDIR}/LP_Detection/valid", help="Directory of sample frames. Defaults to LP_Detection/valid.")
+    parser.add_argument('--frames', type=int, default=20, help="Number of sample frames. Defaults to 20.")
+    parser.add_argument('--repeat', type=int, default=10, help="Passes over the sample frames. Defaults to 10.")
+    parser.add_argument('--config', default=f"{SELFDIR}/config.ini", help="Config to read the number of workers from and write the tuned setting to. Defaults to config.ini.")
+    parser.add_argument('--workers', type=int, help="Number of concurrent workers to tune for. Defaults to max_workers (or num_workers) of the config.")
+    parser.add_argument('--model', default=f"{SELFDIR}/saved_model/model.tflite", help="Lite model to tune. Defaults to saved_model/model.tflite.")
+    parser.add_argument('--model-type', default='lite', help="Detector backend the worker role loads in the startup benchmark. Defaults to lite.")
+    parser.add_argument('--models', default=f"{SELFDIR}/saved_model", help="Model directory of the backend comparison. Defaults to saved_model.")
+    parser.add_argument('--plates', default=f"{SELFDIR}/LP_Detection/trainlps", help="Frames named after their plate for the recognizer comparison. Defaults to LP_Detection/trainlps.")
+    parser.add_argument('--plate-labels', default=f"{SELFDIR}/LP_Detection/trainlabels", help="Plate annotations of the recognizer comparison frames. Defaults to LP_Detection/trainlabels.")
+    parser.add_argument('--plate-set', choices=['evaluation', 'train', 'all'], default='evaluation', help="Plates the recognizers are scored on, the ctc recognizer is trained on the train set of export.splitplates. Defaults to evaluation.")
+    args = parser.parse_args()
+
+    if args.benchmark == 'startup':
+        startup(args.model_type)
+        raise SystemExit
+    if args.benchmark == 'recognizers':
+        config = ConfigParser()
+        config.read(args.config)
+        plates = export.loadplates(args.plates, args.plate_labels)
+        if args.plate_set != 'all':
+            plates = export.splitplates(plates)[args.plate_set == 'evaluation']
+        recognizers(plates, dict(config['GENERAL']), max(1, args.repeat // 5), subset=args.plate_set)
+        raise SystemExit
+    frames = loadframes(args.images, args.frames)
+    if args.benchmark == 'preprocess':
+        preprocess(frames, args.repeat)
+    elif args.benchmark == 'backends':
+        backends(frames, args.models, args.repeat)
+    elif args.benchmark == 'tune':
+        config = ConfigParser()
+        config.read(args.config)
+        workers = args.workers or max(int(config['GENERAL']['num_workers']), int(config['GENERAL'].get('max_workers', 0)))
+        if not frames:
+            raise SystemExit(f"No sample frames in {args.images}")
+        if (best := tune(frames, args.model, workers, repeat=max(1, args.repeat // 5))) is None:
+            raise SystemExit("Every setting failed, the config was not changed")
+        threads, delegate = best
+        config['GENERAL']['lite_threads'] = str(threads)
+        config['GENERAL']['lite_delegate'] = delegate
+        with open(args.config, 'w') as f:
+            config.write(f)
+        print(f"Wrote lite_threads = {threads}, lite_delegate = {delegate} to {args.config}")
@@ -1,96 +1,475 @@
 from multiprocessing import Queue, queues, Manager
 import cv2
+import numpy as np
 import logging
 from logging.handlers import QueueHandler
 import traceback
+import threading
 import time
+import random
+import os
 
-import utils
+import framebuffer
 
-NUM_RETRIES = 5
-RETRY_INTERVAL = 60
+# reconnect backoff in seconds, doubled after every failed attempt up to the maximum
+RETRY_INTERVAL = 1
+RETRY_MAX_INTERVAL = 60
+# seconds without a frame after which the stream is reopened
+STALL_TIMEOUT = 10
+FRAME_SLOTS = 4
+# seconds to keep publishing frames after the last detected change
+MOTION_HOLD = 1.0
+# seconds after which a frame no worker took yet is replaced by a newer one, for cameras without 'max_age'
+REFRESH_INTERVAL = 0.5
+# frame rate of image directory sources with 'realtime' pacing
+DIR_FPS = 25
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+class ReplayCapture:
+    """cv2.VideoCapture-like source replaying a video file ('file' protocol) or an image directory ('dir' protocol).
+    Used to run the pipeline without physical cameras, e.g. for load testing.
+    """
+    def __init__(self, protocol:str, path:str, pacing='realtime', loop=True):
+        """Open the source
+
+        Args:
+            protocol (str): 'file' for a video file, 'dir' for a directory of images.
+            path (str): Path to the video file or the image directory.
+            pacing (str, optional): 'realtime' to play at the source frame rate, 'fast' to play as fast as possible or a number to play at a fixed frame rate. Defaults to 'realtime'.
+            loop (bool, optional): Start over after the last frame. Defaults to True.
+        """
+        self.protocol = protocol
+        self.loop = loop
+        self._next = 0
+        self._shape = None
+        if protocol == 'file':
+            self._vcap = cv2.VideoCapture(path)
+            fps = self._vcap.get(cv2.CAP_PROP_FPS) or DIR_FPS
+        elif protocol == 'dir':
+            self._files = sorted(os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith(IMAGE_EXTENSIONS)) if os.path.isdir(path) else []
+            self._idx = -1
+            fps = DIR_FPS
+        else:
+            raise ValueError(f"Unknown replay protocol {protocol}")
+        pacing = str(pacing).strip().lower()
+        self.fast = pacing == 'fast'
+        if self.fast:
+            self._interval = 0
+        elif pacing == 'realtime':
+            self._interval = 1 / fps
+        else:
+            self._interval = 1 / float(pacing)
+
+    def isOpened(self):
+        if self.protocol == 'file':
+            return self._vcap.isOpened()
+        return len(self._files) > 0
+
+    def _pace(self):
+        now = time.monotonic()
+        if self._next > now:
+            time.sleep(self._next - now)
+        # do not try to catch up after a stall
+        self._next = max(self._next, now - self._interval) + self._interval
+
+    def grab(self):
+        """Advance to the next frame, waiting for its turn according to the pacing
+
+        Returns:
+            bool: Success
+        """
+        if not self.isOpened():
+            return False
+        self._pace()
+        if self.protocol == 'file':
+            if self._vcap.grab():
+                return True
+            if not self.loop:
+                return False
+            self._vcap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            return self._vcap.grab()
+        if self._idx + 1 >= len(self._files) and not self.loop:
+            return False
+        self._idx = (self._idx + 1) % len(self._files)
+        return True
+
+    def retrieve(self):
+        """Decode the current frame. Images of a directory are fitted into the size of the first one, like frames of a camera stream.
+
+        Returns:
+            tuple: (ret, frame)
+        """
+        if self.protocol == 'file':
+            return self._vcap.retrieve()
+        frame = cv2.imread(self._files[self._idx])
+        if frame is None:
+            return False, None
+        if self._shape is None:
+            self._shape = frame.shape
+        elif frame.shape != self._shape:
+            # letterbox to keep the resolution constant
+            h, w = self._shape[:2]
+            scale = min(h / frame.shape[0], w / frame.shape[1])
+            resized = cv2.resize(frame, (max(1, int(frame.shape[1] * scale)), max(1, int(frame.shape[0] * scale))))
+            frame = np.zeros(self._shape, dtype=np.uint8)
+            y, x = (h - resized.shape[0]) // 2, (w - resized.shape[1]) // 2
+            frame[y:y+resized.shape[0], x:x+resized.shape[1]] = resized
+        return True, frame
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def release(self):
+        if self.protocol == 'file':
+            self._vcap.release()
+
+class MotionGate:
+    """Change detector comparing downscaled grayscale frames to a running background model.
+    Decides which frames are worth publishing to the workers.
+    """
+    def __init__(self, threshold=0.005, sensitivity=25, min_fps=1.0, hold=MOTION_HOLD, learning_rate=0.05, width=160):
+        """Initialize the change detector
+
+        Args:
+            threshold (float, optional): Fraction of changed pixels required to count as a change. Defaults to 0.005.
+            sensitivity (int, optional): Grayscale difference from the background required for a pixel to count as changed. Defaults to 25.
+            min_fps (float, optional): Frame rate floor, frames are published at least this often even without a change. 0 disables the floor. Defaults to 1.0.
+            hold (float, optional): Seconds to keep publishing after the last change. Defaults to MOTION_HOLD.
+            learning_rate (float, optional): Background model adaptation rate. Defaults to 0.05.
+            width (int, optional): Width of the downscaled frame. Defaults to 160.
+        """
+        self.threshold = threshold
+        self.sensitivity = sensitivity
+        self.min_interval = 1 / min_fps if min_fps > 0 else float('inf')
+        self.hold = hold
+        self.learning_rate = learning_rate
+        self.width = width
+        self.background = None
+        self.last_publish = 0
+        self.last_change = 0
+        self.skipped = 0
+
+    @classmethod
+    def fromcfg(cls, cfg:dict):
+        """Create a change detector from the camera config, None if 'motion_threshold' is not set
+
+        Args:
+            cfg (dict): Camera config as a dictionary.
+
+        Returns:
+            MotionGate: Change detector
+        """
+        if not cfg.get('motion_threshold'):
+            return None
+        return cls(threshold=float(cfg['motion_threshold']), sensitivity=float(cfg.get('motion_sensitivity', 25)), min_fps=float(cfg.get('min_fps', 1)))
+
+    def __call__(self, frame:np.ndarray, now:float=None):
+        """Update the background model with the frame and decide whether to publish it
+
+        Args:
+            frame (np.ndarray): BGR or grayscale frame, already cropped to the region of interest.
+            now (float, optional): Frame time. Defaults to the current time.
+
+        Returns:
+            bool: Publish the frame
+        """
+        now = time.time() if now is None else now
+        height = max(1, frame.shape[0] * self.width // frame.shape[1])
+        small = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        small = cv2.GaussianBlur(small, (5, 5), 0).astype(np.float32)
+
+        if self.background is None or self.background.shape != small.shape:
+            self.background = small
+            self.last_change = now
+        else:
+            changed = np.count_nonzero(cv2.absdiff(small, self.background) > self.sensitivity) / small.size
+            cv2.accumulateWeighted(small, self.background, self.learning_rate)
+            if changed >= self.threshold:
+                self.last_change = now
+
+        if now - self.last_change <= self.hold or now - self.last_publish >= self.min_interval:
+            self.last_publish = now
+            return True
+        self.skipped += 1
+        return False
+
+class FrameGrabber:
+    """Thread keeping the stream buffer drained with VideoCapture.grab. Frames are only decoded with VideoCapture.retrieve when requested through 'read'.
+    All VideoCapture calls happen on the grabber thread.
+    """
+    def __init__(self, vcap:cv2.VideoCapture, drain=True):
+        """Initialize the grabber and start its thread
+
+        Args:
+            vcap (cv2.VideoCapture): Opened video capture.
+            drain (bool, optional): Keep grabbing between requests. Disable for sources which do not buffer, e.g. unpaced replays. Defaults to True.
+        """
+        self._vcap = vcap
+        self.drain = drain
+        self._request = threading.Event()
+        self._cond = threading.Condition()
+        self._frame = None
+        # capture time of the last frame returned by read
+        self.timestamp = 0.0
+        self.ok = True
+        self.grabbed = 0
+        self.retrieved = 0
+        self.dropped = 0
+        self.running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while self.running:
+            if not self.drain and not self._request.wait(0.1):
+                continue
+            self.ok = self._vcap.grab()
+            if not self.ok:
+                time.sleep(0.1)
+                continue
+            self.grabbed += 1
+            if not self._request.is_set():
+                self.dropped += 1
+                continue
+            self._request.clear()
+            grabtime = time.time()
+            frame = self._vcap.retrieve()
+            self.retrieved += 1
+            with self._cond:
+                self.timestamp = grabtime
+                self._frame = frame
+                self._cond.notify_all()
+
+    def read(self, timeout=1.0):
+        """Decode the next grabbed frame
+
+        Args:
+            timeout (float, optional): Seconds to wait for a frame. Defaults to 1.0.
+
+        Returns:
+            tuple: (ret, frame) like cv2.VideoCapture.read
+        """
+        with self._cond:
+            self._frame = None
+            self._request.set()
+            if not self._cond.wait_for(lambda: self._frame is not None, timeout):
+                return False, None
+            return self._frame
+
+    def stop(self):
+        """Stop the grabber thread
+        """
+        self.running = False
+        self._thread.join()
 
 class Camera:
     """A class to represent a camera and its connection to the system.
     """
-    def __init__(self, cfg:dict, output, loggerQueue=Queue(), autoconnect=False):
+    def __init__(self, cfg:dict, output, loggerQueue=Queue(), autoconnect=False, ready:framebuffer.ReadySet=None):
         """Initialize the class. If autoconnect is set to True, the camera will connect automatically.
 
         Args:
             cfg (dict): Camara config as a dictionary.
-            output (Namespace): Multiprocessing namespace, Stores the current frame in the 'cam_id{camera_id}' variable.
+            output (str): Shared memory name of the frame buffer, which the camera creates once connected. See framebuffer.FrameRingBuffer.
             loggerQueue (Queue, optional): Queue for logging connections. Defaults to multiprocessing.Queue().
             autoconnect (bool, optional): Automatically connect to the camera. Defaults to False.
+            ready (framebuffer.ReadySet, optional): Ready set to notify of new frames. The camera only decodes frames requested through it. Every frame is published if None. Defaults to None.
         """
-        # add logging and logging queue
+        # add logging and logging queue, once per process as several cameras can share one
         self.logger = logging.getLogger()
         self.logger.setLevel(logging.INFO)
-        self.logger.addHandler(QueueHandler(loggerQueue))
+        if not any(isinstance(h, QueueHandler) and h.queue is loggerQueue for h in self.logger.handlers):
+            self.logger.addHandler(QueueHandler(loggerQueue))
 
         self.cfg = cfg
+        if isinstance(cfg.get('crop'), str):
+            # config values are strings, 'x, y, width, height'
+            cfg['crop'] = [int(i) for i in cfg['crop'].split(',')] if cfg['crop'].strip() else False
         self._output = output
+        self._vcap = None
+        self._buffer = None
+        self._grabber = None
+        self._stop = threading.Event()
+        self._ready = ready
+        # only publish frames in which the region of interest changed, if configured
+        self._gate = MotionGate.fromcfg(cfg)
+        # a waiting frame is replaced before it passes the deadline of the camera
+        max_age = float(cfg.get('max_age') or 0)
+        self._refresh = max_age / 2 if max_age else REFRESH_INTERVAL
 
         if autoconnect:
             self.connect(autostart=True)
 
+    def _open(self):
+        """Open the video capture for the configured source
+        """
+        if self.cfg['protocol'] in ('file', 'dir'):
+            self.logger.info("Replaying {protocol} {path} as camera {id}".format(**self.cfg))
+            return ReplayCapture(self.cfg['protocol'], self.cfg['path'], self.cfg.get('pacing', 'realtime'), str(self.cfg.get('loop', True)).lower() not in ('false', '0', 'no'))
+        # self.logger.info(f"Connecting to camera {self.cfg['id']} at {self.cfg['ip']}:{self.cfg['port']}")
+        self.logger.info("Connecting to camera {id} at {ip}:{port}".format(**self.cfg))
+        # return cv2.VideoCapture(f"{self.cfg['protocol']}://{self.cfg['login']}:{self.cfg['password']}@{self.cfg['ip']}:{int(self.cfg['port'])}")
+        return cv2.VideoCapture("{protocol}://{login}:{password}@{ip}:{port}".format(**self.cfg))
+
     def connect(self, autostart=False):
-        """Connect to the camera. If autostart is set to True, the camera will start sending frames to the output queue.
+        """Connect to the camera, retrying with a jittered exponential backoff until connected or stopped.
+        If autostart is set to True, the camera will start sending frames to the frame buffer.
 
         Args:
             autostart (bool, optional): Start automatically after connecting. Defaults to False.
         """
-        # self.logger.info(f"Connecting to camera {self.cfg['id']} at {self.cfg['ip']}:{self.cfg['port']}")
-        self.logger.info("Connecting to camera {id} at {ip}:{port}".format(**self.cfg))
-
-        # self._vcap = cv2.VideoCapture(f"{self.cfg['protocol']}://{self.cfg['login']}:{self.cfg['password']}@{self.cfg['ip']}:{int(self.cfg['port'])}")
-        self._vcap = cv2.VideoCapture("{protocol}://{login}:{password}@{ip}:{port}".format(**self.cfg))
-        connected = False
         attempt = 0
-        while not connected and attempt < NUM_RETRIES:
+        while not self._stop.is_set():
+            # the capture of the previous attempt was released already
+            self._vcap = None
             try:
-                ret ,_= self._vcap.read()
-                if not ret:
-                    self.logger.critical(f"Failed to connect to camera {self.cfg['id']}, attempt: {attempt}")
-                    attempt += 1
-                    time.sleep(RETRY_INTERVAL)
-                    continue
-                connected = True
-            except:traceback.print_exc();return
-        if not connected:
-            self.logger.error(f"Failed to connect to canera {self.cfg['id']}, out of retries")
-            exit()
+                self._vcap = self._open()
+                ret, frame = self._vcap.read()
+            except Exception:
+                self.logger.error(traceback.format_exc())
+                ret = False
+            if ret:
+                break
+            if self._vcap is not None:
+                self._vcap.release()
+            delay = backoff(attempt)
+            self.logger.critical(f"Failed to connect to camera {self.cfg['id']}, attempt: {attempt}, retrying in {delay:.1f}s")
+            attempt += 1
+            self._stop.wait(delay)
+        else:
+            return
+        # size the frame buffer slots from the stream resolution
+        shape = self._crop(frame).shape
+        if self._buffer is None or int(np.prod(shape)) > self._buffer.capacity:
+            if self._buffer is not None:
+                # the resolution changed, the readers re-attach to the new buffer
+                self._buffer.close()
+            self._buffer = framebuffer.FrameRingBuffer.create(self._output, shape, int(self.cfg.get('buffer_slots', FRAME_SLOTS)))
+            self.logger.info(f"Camera {self.cfg['id']} frame buffer created for {shape[1]}x{shape[0]} frames")
+        self._grabber = FrameGrabber(self._vcap, drain=not (isinstance(self._vcap, ReplayCapture) and self._vcap.fast))
         if autostart:
             self.run()
 
+    def _disconnect(self):
+        if self._grabber is not None:
+            self._grabber.stop()
+            self._grabber = None
+        if self._vcap is not None:
+            self._vcap.release()
+
+    def _crop(self, frame):
+        """Crop the frame to the 'crop' config variable, if set
+        """
+        if self.cfg.get('crop', False):
+            x, y, w, h = self.cfg['crop']
+            frame = frame[y:y+h, x:x+w]
+        return frame
+
+    @property
+    def dropped(self):
+        """Number of frames received from the camera but never decoded"""
+        return self._grabber.dropped if self._grabber is not None else 0
+
+    def _stale(self):
+        """True if the frame waiting for a worker is older than the refresh interval, half of 'max_age' or REFRESH_INTERVAL"""
+        ref = self._buffer.latest()
+        return ref is None or time.time() - ref.timestamp > self._refresh
+
     def run(self):
-        """Start sending frames to the output queue.
+        """Start sending frames to the frame buffer. A frame is only decoded once a worker asks for one through the ready set.
+        While it was not taken yet, the stream is only grabbed and the frame is replaced once it gets older than the refresh interval,
+        so cameras waiting for a busy pool cost no decoding and workers never get a frame past its deadline.
+        Reconnects if the stream stalls for more than STALL_TIMEOUT seconds.
         """
         ret2 = False
-        while True:
+        dropped = 0
+        while not self._stop.is_set():
             try:
-                ret, frame = self._vcap.read()
+                # the stop flag is checked at least every 100 ms while no frame is wanted
+                if self._ready is not None and not (self._buffer.pending and self._stale()) and not self._ready.requested(self._output, 0.1):
+                    continue
+                ret, frame = self._grabber.read()
+                self._buffer.dropped = dropped + self._grabber.dropped
                 if not ret:
                     if not ret2:
-                        self.logger.warning('Failed to grab frame')
+                        self.logger.warning(f"Failed to grab frame from camera {self.cfg['id']}")
+                        failed_since = time.time()
                     ret2 = True
+                    if isinstance(self._vcap, ReplayCapture) and not self._vcap.loop:
+                        self.logger.info(f"Replay of camera {self.cfg['id']} finished")
+                        break
+                    if time.time() - failed_since > STALL_TIMEOUT:
+                        self.logger.warning(f"Camera {self.cfg['id']} stalled, reconnecting")
+                        dropped += self._grabber.dropped
+                        self._disconnect()
+                        self.connect()
+                        if self._grabber is None:
+                            break
+                    continue
                 elif ret2:
-                    self.logger.info('Camera is back online')
+                    self.logger.info(f"Camera {self.cfg['id']} is back online")
                     ret2 = False
 
-                if self.cfg.get('crop', False):
-                    x, y, w, h = self.cfg['crop']
-                    frame = frame[y:y+h, x:x+w]
-
-                setattr(self._output, f"cam_id{self.cfg['id']}", utils.Task(self.cfg['id'], frame))
+                frame = self._crop(frame)
+                if self._gate is None or self._gate(frame):
+                    self._buffer.write(frame, timestamp=self._grabber.timestamp)
+                    if self._ready is not None:
+                        self._ready.notify()
+                elif self._ready is not None and not self._buffer.pending:
+                    # the request is still open, try the next frame
+                    self._ready.request(self._output)
 
             except Exception as e:
                 self.logger.error(f"Failed to read from camera {self.cfg['id']}")
                 self.logger.error(traceback.format_exc())
-                setattr(self._output, f"id{self.cfg['id']}", [])
                 if type(e) == KeyboardInterrupt:
                     break
 
-        self._vcap.release()
+        self._disconnect()
+        if self._buffer is not None:
+            self._buffer.close()
+
+    def stop(self):
+        """Stop connecting / sending frames, run returns shortly after
+        """
+        self._stop.set()
 
     def __delete__(self):
-        self._vcap.release()
+        self._disconnect()
+        if self._buffer is not None:
+            self._buffer.close()
+
+def backoff(attempt:int):
+    """Jittered exponential backoff delay before the next connection attempt
+
+    Args:
+        attempt (int): Number of failed attempts so far.
+
+    Returns:
+        float: Delay in seconds
+    """
+    return min(RETRY_MAX_INTERVAL, RETRY_INTERVAL * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+def capture(cfgs:list, outputs:list, loggerQueue=Queue(), ready:framebuffer.ReadySet=None):
+    """Capture process target serving several cameras, each one on its own thread so a flapping camera does not block the others.
+
+    Args:
+        cfgs (list): Camera configs as dictionaries.
+        outputs (list): Shared memory names of the camera frame buffers.
+        loggerQueue (Queue, optional): Queue for logging connections. Defaults to multiprocessing.Queue().
+        ready (framebuffer.ReadySet, optional): Ready set to notify of new frames. Defaults to None.
+    """
+    cameras = [Camera(cfg, output, loggerQueue, ready=ready) for cfg, output in zip(cfgs, outputs)]
+    threads = [threading.Thread(target=cam.connect, kwargs={"autostart":True}, name=f"Camera_{cam.cfg['id']}", daemon=True) for cam in cameras]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        for cam in cameras:
+            cam.stop()
@@ -0,0 +1,713 @@
+import abc
+import importlib.util
+import logging
+import os
+import numpy as np
+import cv2
+
+# side length of the square model input
+INPUT_SIZE = 640
+
+# detector backends by model type name, filled by 'register'
+BACKENDS = {}
+
+
+def register(name:str):
+    """Class decorator adding a detector backend to BACKENDS
+
+    Args:
+        name (str): Model type name of the backend, as used in the 'model_type' config option.
+
+    Returns:
+        Callable: The decorator
+    """
+    def decorator(cls):
+        cls.name = name
+        BACKENDS[name] = cls
+        return cls
+    return decorator
+
+def create(model_type:str, directory:str, **options):
+    """Create the detector of a model type
+
+    Args:
+        model_type (str): Backend name, optionally followed by '-<variant>' (e.g. 'lite-int8').
+        directory (str): Model directory.
+        **options: Backend options like 'num_threads' and 'delegate', options a backend does not use are ignored.
+
+    Raises:
+        KeyError: Unknown backend
+
+    Returns:
+        BaseDetector: The detector
+    """
+    name, _, variant = model_type.partition('-')
+    backend = BACKENDS[name]
+    return backend(backend.modelpath(directory, variant), **options)
+
+def available(directory:str=None):
+    """Get the backends whose runtime is installed
+
+    Args:
+        directory (str, optional): Model directory, only backends with a model in it are returned if set. Defaults to None.
+
+    Returns:
+        list: Backend names
+    """
+    return [name for name, backend in BACKENDS.items() if backend.installed() and (directory is None or os.path.exists(backend.modelpath(directory)))]
+
+def preprocess(img:np.ndarray, out:np.ndarray, resized:np.ndarray=None):
+    """Resize an image and scale it to [0, 1] into a preallocated float32 buffer, without intermediate full frame copies
+
+    Args:
+        img (np.ndarray): Image to be processed.
+        out (np.ndarray): Float32 (height, width, 3) buffer to write to, e.g. a view of the interpreter input tensor. Images of its size are not resized.
+        resized (np.ndarray, optional): Uint8 (height, width, 3) scratch buffer for the resized image. Allocated if None.
+
+    Returns:
+        np.ndarray: out
+    """
+    if img.shape[:2] != out.shape[:2]:
+        img = cv2.resize(img, (out.shape[1], out.shape[0]), dst=resized)
+    np.multiply(img, np.float32(1 / 255), out=out)
+    return out
+
+def nms(boxes:np.ndarray, scores:np.ndarray, threshold:float=0.5, overlap:str='iou'):
+    """Non-maximum suppression of (ymin, xmin, ymax, xmax) boxes
+
+    Args:
+        boxes (np.ndarray): (N, 4) boxes.
+        scores (np.ndarray): (N,) scores.
+        threshold (float, optional): Boxes overlapping a better box by more than this are suppressed. Defaults to 0.5.
+        overlap (str, optional): 'iou' for the intersection over union, 'min' for the intersection over the smaller box, which also suppresses the partial boxes of a plate cut by a tile border. Defaults to 'iou'.
+
+    Returns:
+        np.ndarray: Indices of the kept boxes, best first
+    """
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    order = np.argsort(scores)[::-1]
+    areas = np.clip(boxes[:, 2] - boxes[:, 0], 0, None) * np.clip(boxes[:, 3] - boxes[:, 1], 0, None)
+    keep = []
+    while order.size:
+        best, rest = order[0], order[1:]
+        keep.append(best)
+        h = np.clip(np.minimum(boxes[best, 2], boxes[rest, 2]) - np.maximum(boxes[best, 0], boxes[rest, 0]), 0, None)
+        w = np.clip(np.minimum(boxes[best, 3], boxes[rest, 3]) - np.maximum(boxes[best, 1], boxes[rest, 1]), 0, None)
+        inter = h * w
+        union = np.minimum(areas[best], areas[rest]) if overlap == 'min' else areas[best] + areas[rest] - inter
+        order = rest[inter <= threshold * np.maximum(union, 1e-12)]
+    return np.asarray(keep, dtype=np.int64)
+
+def _detections(names:list, outputs:list):
+    """Pick the scores and boxes out of the model outputs, by name or like the lite model by position (scores first, then boxes)
+
+    Args:
+        names (list): Output names.
+        outputs (list): Output arrays.
+
+    Returns:
+        tuple: (scores, boxes)
+    """
+    named = dict(zip(names, outputs))
+    scores = next((value for key, value in named.items() if 'score' in key.lower()), outputs[0])
+    boxes = next((value for key, value in named.items() if 'box' in key.lower()), outputs[1])
+    return np.asarray(scores), np.asarray(boxes)
+
+
+class BaseDetector(abc.ABC):
+    """Common interface of the detector backends, a backend implements 'modelpath' and '__call__'.
+    Detections are dicts with 'detection_scores' (1, N) and 'detection_boxes' (1, N, 4) numpy arrays, the boxes are normalized (ymin, xmin, ymax, xmax).
+    """
+    name = None
+    # top level modules needed by the backend
+    requires = ()
+    # images are resized to the fixed model input, so one blank image of any size warms the backend up
+    resizes = True
+
+    @classmethod
+    def installed(cls):
+        """Whether the runtime of the backend is installed"""
+        return all(importlib.util.find_spec(module) is not None for module in cls.requires)
+
+    @classmethod
+    @abc.abstractmethod
+    def modelpath(cls, directory:str, variant:str=''):
+        """Path of the model of the backend
+
+        Args:
+            directory (str): Model directory.
+            variant (str, optional): Model variant. Defaults to ''.
+
+        Returns:
+            str: Model path
+        """
+
+    @abc.abstractmethod
+    def __call__(self, img):
+        """Detect license plates in the image
+
+        Args:
+            img (np.ndarray): Image to be processed
+
+        Returns:
+            dict: 'detection_scores' and 'detection_boxes' of the image
+        """
+
+    def batch(self, imgs:list):
+        """Detect license plates in several images
+
+        Args:
+            imgs (list): Images to be processed
+
+        Returns:
+            list: Detections of every image in the format returned by '__call__'
+        """
+        return [self(img) for img in imgs]
+
+    def warmup(self, shapes:list):
+        """Run the detector once on a blank image of every input shape, so the first frames do not pay for tracing, allocation or weight packing.
+        Backends which resize the images to their model input run once on a model input sized image if no shape is given
+
+        Args:
+            shapes (list): (height, width, 3) input shapes.
+        """
+        if not shapes and self.resizes:
+            shapes = [(INPUT_SIZE, INPUT_SIZE, 3)]
+        for shape in shapes:
+            self(np.zeros(shape, dtype=np.uint8))
+
+
+@register('tf')
+class Detector(BaseDetector):
+    """Wrapper detector class for the Tensorflow model. Runs a concrete function with a fixed input signature per input size, so a size is only traced once
+    """
+    requires = ('tensorflow',)
+    # every input size is traced on its own
+    resizes = False
+
+    def __init__(self, path:str, *args, input_shapes:list=None, **kwargs):
+        """Initialize the class and load the model
+
+        Args:
+            path (str): Path to the model for license plate detection
+            input_shapes (list, optional): (height, width, 3) input shapes to trace and warm up right away. Defaults to None.
+        """
+        import tensorflow as tf
+        self.logger = logging.getLogger()
+        self._tf = tf
+        try:
+            self.model = tf.saved_model.load(path)
+        except OSError:
+            self.logger.error('Unable to load model')
+            raise
+        # the exported signature fixes the input dtype and, for most exports, a batch size of 1
+        self.dtype, self.batchsize = tf.uint8, None
+        if signature := getattr(self.model, 'signatures', {}).get('serving_default'):
+            spec = next(iter(signature.structured_input_signature[1].values()))
+            self.dtype, self.batchsize = spec.dtype, spec.shape[0]
+        # concrete functions by input shape
+        self.functions = {}
+        self.warmup(input_shapes or [])
+
+    @classmethod
+    def modelpath(cls, directory:str, variant:str=''):
+        return f"{directory}/saved_model"
+
+    def function(self, shape:tuple):
+        """Get the concrete function of an input shape, tracing it on first use
+
+        Args:
+            shape (tuple): (height, width, 3) input shape.
+
+        Returns:
+            ConcreteFunction: Function of a (batch, height, width, 3) tensor returning the scores and boxes
+        """
+        shape = tuple(shape)
+        if shape not in self.functions:
+            tf = self._tf
+            outputs = lambda x: {key:value for key, value in self.model(x).items() if key in ('detection_scores', 'detection_boxes')}
+            self.functions[shape] = tf.function(outputs).get_concrete_function(tf.TensorSpec([self.batchsize, *shape], self.dtype))
+            self.logger.info(f"Traced the detection function for {shape[1]}x{shape[0]} inputs")
+        return self.functions[shape]
+
+    def __call__(self, img):
+        """Detect license plates in the image
+
+        Args:
+            img (np.ndarray): Image to be processed
+
+        Returns:
+            dict: 'detection_scores' and 'detection_boxes' of the image
+        """
+        return self.batch([img])[0]
+
+    def batch(self, imgs:list):
+        """Detect license plates in several images, images of the same size are stacked into a single model call if the signature allows batches
+
+        Args:
+            imgs (list): Images to be processed
+
+        Returns:
+            list: Detections of every image in the format returned by '__call__'
+        """
+        results = [None] * len(imgs)
+        groups = {}
+        for i, img in enumerate(imgs):
+            groups.setdefault(np.shape(img), []).append(i)
+        for shape, indices in groups.items():
+            function = self.function(shape)
+            chunks = [indices] if self.batchsize is None else [[i] for i in indices]
+            for chunk in chunks:
+                detections = function(self._tf.convert_to_tensor(np.stack([imgs[i] for i in chunk]), dtype=self.dtype))
+                scores, boxes = detections['detection_scores'].numpy(), detections['detection_boxes'].numpy()
+                for j, i in enumerate(chunk):
+                    results[i] = {'detection_scores':scores[j:j + 1], 'detection_boxes':boxes[j:j + 1]}
+        return results
+
+
+def load_tflite():
+    """Import the TensorFlow Lite interpreter, the standalone tflite_runtime package is preferred over a full TensorFlow import
+
+    Returns:
+        tuple: (Interpreter, load_delegate, OpResolverType)
+    """
+    try:
+        from tflite_runtime.interpreter import Interpreter, load_delegate, OpResolverType
+        return Interpreter, load_delegate, OpResolverType
+    except ImportError:
+        import tensorflow as tf
+        return tf.lite.Interpreter, tf.lite.experimental.load_delegate, tf.lite.experimental.OpResolverType
+
+@register('lite')
+class LiteDetector(BaseDetector):
+    """Wrapper detector class for the Tensorflow Lite model, runs on tflite_runtime if it is installed
+    """
+    @classmethod
+    def installed(cls):
+        return any(importlib.util.find_spec(module) is not None for module in ('tflite_runtime', 'tensorflow'))
+
+    @classmethod
+    def modelpath(cls, directory:str, variant:str=''):
+        # quantized variants exported by export.py are selected with 'lite-<variant>'
+        return f"{directory}/model_{variant}.tflite" if variant else f"{directory}/model.tflite"
+
+    def __init__(self, path: str, *args, num_threads:int=None, delegate:str='xnnpack', **kwargs):
+        """Initialize the class and load the model
+
+        Args:
+            path (str): Path to the model for license plate detection
+            num_threads (int, optional): Number of interpreter threads. TensorFlow Lite decides if None. Defaults to None.
+            delegate (str, optional): 'xnnpack' for the default XNNPACK delegate, 'none' for the plain builtin kernels or the path of an external delegate library. Defaults to 'xnnpack'.
+        """
+        self.logger = logging.getLogger()
+        self.path = path
+        self.num_threads = num_threads
+        self.delegate = delegate
+        self.interpreter = self._interpreter()
+        self.interpreter.allocate_tensors()
+        self.input_details = self.interpreter.get_input_details()
+        self.output_details = self.interpreter.get_output_details()
+        # scratch buffer for the resized frame, the scaled frame is written straight into the interpreter input
+        self._resized = np.empty((INPUT_SIZE, INPUT_SIZE, 3), dtype=np.uint8)
+        # interpreters allocated for larger batches, by batch size. None for sizes which failed the verification
+        self.interpreters = {1:self.interpreter}
+
+    def __call__(self, img):
+        """Detect license plates in the image
+
+        Args:
+            img (np.ndarray): Image to be processed
+
+        Returns:
+            dict: 'detection_scores' and 'detection_boxes' of the image
+        """
+        # the view of the input tensor must not be held while invoking
+        preprocess(img, self.interpreter.tensor(self.input_details[0]['index'])()[0], self._resized)
+        self.interpreter.invoke()
+        conf = self.interpreter.get_tensor(self.output_details[0]['index'])
+        boxes = self.interpreter.get_tensor(self.output_details[1]['index'])
+        return {'detection_scores':conf, 'detection_boxes':boxes}
+
+    def batch(self, imgs:list):
+        """Detect license plates in several images with a single interpreter call.
+        Batches are padded to the next power of two, so only a few interpreters are allocated.
+
+        Args:
+            imgs (list): Images to be processed
+
+        Returns:
+            list: Detections of every image in the format returned by '__call__'
+        """
+        if len(imgs) <= 1:
+            return [self(img) for img in imgs]
+        size = 1 << (len(imgs) - 1).bit_length()
+        if size not in self.interpreters:
+            self.interpreters[size] = self._batchinterpreter(size, imgs)
+        if (interpreter := self.interpreters[size]) is None:
+            return [self(img) for img in imgs]
+        return self._invoke(interpreter, size, imgs)
+
+    def _interpreter(self):
+        """Create an interpreter with the configured threads and delegate
+
+        Returns:
+            Interpreter: The interpreter, tensors not allocated yet
+        """
+        Interpreter, load_delegate, OpResolverType = load_tflite()
+        options = {'model_path':self.path, 'num_threads':self.num_threads}
+        if self.delegate == 'none':
+            options['experimental_op_resolver_type'] = OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+        elif self.delegate not in (None, 'xnnpack'):
+            options['experimental_delegates'] = [load_delegate(self.delegate)]
+        return Interpreter(**options)
+
+    def _invoke(self, interpreter, size:int, imgs:list):
+        """Run a batch interpreter, padding the batch with empty images
+
+        Args:
+            interpreter (Interpreter): Interpreter allocated for 'size' images.
+            size (int): Batch size of the interpreter.
+            imgs (list): Up to 'size' images.
+
+        Returns:
+            list: Detections of every image in the format returned by '__call__'
+        """
+        input_tensor = interpreter.tensor(self.input_details[0]['index'])()
+        for i, img in enumerate(imgs):
+            preprocess(img, input_tensor[i], self._resized)
+        input_tensor[len(imgs):] = 0
+        del input_tensor
+        interpreter.invoke()
+        conf = interpreter.get_tensor(self.output_details[0]['index'])
+        boxes = interpreter.get_tensor(self.output_details[1]['index'])
+        return [{'detection_scores':conf[i:i + 1], 'detection_boxes':boxes[i:i + 1]} for i in range(len(imgs))]
+
+    def _batchinterpreter(self, size:int, imgs:list, atol:float=1e-3):
+        """Allocate an interpreter for a batch size and verify its results against the single image path
+
+        Args:
+            size (int): Batch size.
+            imgs (list): Images to verify the results with.
+            atol (float, optional): Maximum absolute difference of the scores and boxes. Defaults to 1e-3.
+
+        Returns:
+            Interpreter: The interpreter, None if the model does not support the batch size or the results differ
+        """
+        try:
+            interpreter = self._interpreter()
+            interpreter.resize_tensor_input(self.input_details[0]['index'], [size, INPUT_SIZE, INPUT_SIZE, 3])
+            interpreter.allocate_tensors()
+            batched = self._invoke(interpreter, size, imgs)
+        except (ValueError, RuntimeError) as e:
+            self.logger.warning(f"Batch size {size} is not supported by the model, detecting one image at a time: {e}")
+            return None
+        for img, result in zip(imgs, batched):
+            single = self(img)
+            if any(np.shape(result[key]) != np.shape(single[key]) or not np.allclose(result[key], single[key], atol=atol) for key in single):
+                self.logger.warning(f"Batch size {size} gives different results than single images, detecting one image at a time")
+                return None
+        self.logger.info(f"Allocated interpreter for batches of {size} images")
+        return interpreter
+
+
+@register('onnx')
+class OnnxDetector(BaseDetector):
+    """Detector running an ONNX export of the lite model (NHWC input) on the ONNX Runtime CPU provider
+    """
+    requires = ('onnxruntime',)
+
+    @classmethod
+    def modelpath(cls, directory:str, variant:str=''):
+        return f"{directory}/model_{variant}.onnx" if variant else f"{directory}/model.onnx"
+
+    def __init__(self, path:str, *args, num_threads:int=None, **kwargs):
+        """Initialize the class and load the model
+
+        Args:
+            path (str): Path to the ONNX model.
+            num_threads (int, optional): Number of intra-op threads. ONNX Runtime decides if None. Defaults to None.
+        """
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input = self.session.get_inputs()[0]
+        self.outputs = [output.name for output in self.session.get_outputs()]
+        # symbolic batch dimension
+        self.dynamic = not isinstance(self.input.shape[0], int)
+        # some exports take the raw 0-255 frame
+        self.raw = self.input.type == 'tensor(uint8)'
+        self._resized = np.empty((INPUT_SIZE, INPUT_SIZE, 3), dtype=np.uint8)
+
+    def __call__(self, img):
+        return self._run([img])[0]
+
+    def batch(self, imgs:list):
+        if not self.dynamic:
+            return [self(img) for img in imgs]
+        return self._run(imgs)
+
+    def _run(self, imgs:list):
+        """Run the session on a stacked batch
+
+        Args:
+            imgs (list): Images to be processed.
+
+        Returns:
+            list: Detections of every image in the format returned by '__call__'
+        """
+        if self.raw:
+            inputs = np.stack([cv2.resize(img, (INPUT_SIZE, INPUT_SIZE)) for img in imgs])
+        else:
+            inputs = np.empty((len(imgs), INPUT_SIZE, INPUT_SIZE, 3), dtype=np.float32)
+            for i, img in enumerate(imgs):
+                preprocess(img, inputs[i], self._resized)
+        scores, boxes = _detections(self.outputs, self.session.run(self.outputs, {self.input.name:inputs}))
+        return [{'detection_scores':scores[i:i + 1], 'detection_boxes':boxes[i:i + 1]} for i in range(len(imgs))]
+
+
+@register('opencv')
+class CvDnnDetector(BaseDetector):
+    """Detector running the ONNX export of the lite model with the OpenCV DNN module, no additional runtime is needed
+    """
+    requires = ('cv2',)
+
+    @classmethod
+    def modelpath(cls, directory:str, variant:str=''):
+        return OnnxDetector.modelpath(directory, variant)
+
+    def __init__(self, path:str, *args, num_threads:int=None, **kwargs):
+        """Initialize the class and load the model
+
+        Args:
+            path (str): Path to the ONNX model.
+            num_threads (int, optional): Number of OpenCV threads of the process. OpenCV decides if None. Defaults to None.
+        """
+        self.logger = logging.getLogger()
+        self.net = cv2.dnn.readNet(path)
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        if num_threads:
+            cv2.setNumThreads(num_threads)
+        self.outputs = list(self.net.getUnconnectedOutLayersNames())
+        self.batched = True
+        self._resized = np.empty((INPUT_SIZE, INPUT_SIZE, 3), dtype=np.uint8)
+
+    def __call__(self, img):
+        return self._run([img])[0]
+
+    def batch(self, imgs:list):
+        if self.batched and len(imgs) > 1:
+            try:
+                return self._run(imgs)
+            except cv2.error as e:
+                self.logger.warning(f"The model does not support batches in OpenCV DNN, detecting one image at a time: {e}")
+                self.batched = False
+        return [self(img) for img in imgs]
+
+    def _run(self, imgs:list):
+        """Run the network on a stacked batch
+
+        Args:
+            imgs (list): Images to be processed.
+
+        Returns:
+            list: Detections of every image in the format returned by '__call__'
+        """
+        inputs = np.empty((len(imgs), INPUT_SIZE, INPUT_SIZE, 3), dtype=np.float32)
+        for i, img in enumerate(imgs):
+            preprocess(img, inputs[i], self._resized)
+        self.net.setInput(inputs)
+        scores, boxes = _detections(self.outputs, self.net.forward(self.outputs))
+        return [{'detection_scores':scores[i:i + 1], 'detection_boxes':boxes[i:i + 1]} for i in range(len(imgs))]
+
+
+class RegionDetector:
+    """Detection front-end of a camera. Runs a detector on the regions of interest of the frame, split into overlapping tiles if they are larger than 'tile' pixels, and merges the detections back to full frame coordinates.
+    """
+    def __init__(self, detector:BaseDetector, rois:list=None, tile:int=0, overlap:float=0.2, letterbox:bool=False, min_score:float=0.1, nms_threshold:float=0.6, resolution:tuple=None):
+        """Initialize the front-end
+
+        Args:
+            detector (BaseDetector): The detector.
+            rois (list, optional): (x, y, width, height) pixel regions of the frame to detect in. The whole frame if None. Defaults to None.
+            tile (int, optional): Maximum side in pixels of a region detected at once, larger regions are tiled. No tiling if 0. Defaults to 0.
+            overlap (float, optional): Overlap of neighbouring tiles as a fraction of the tile side, should be larger than a plate. Defaults to 0.2.
+            letterbox (bool, optional): Keep the aspect ratio of the regions, padding them to the square model input. They are stretched otherwise, like the training images of the shipped model. Defaults to False.
+            min_score (float, optional): Minimum score of the detections kept when merging several regions or tiles. Defaults to 0.1.
+            nms_threshold (float, optional): Intersection over the smaller box above which merged detections are suppressed. Defaults to 0.6.
+            resolution (tuple, optional): (width, height) of the camera frames, to know the input shapes before the first frame. Defaults to None.
+        """
+        self.detector = detector
+        self.rois = rois
+        self.tile = tile
+        self.overlap = overlap
+        self.letterbox = letterbox
+        self.min_score = min_score
+        self.nms_threshold = nms_threshold
+        self.resolution = resolution
+        # views by frame shape, the frames of a camera keep their size
+        self._views = {}
+        # letterbox inputs by frame shape, reused for the following frames
+        self._canvases = {}
+
+    @classmethod
+    def fromcfg(cls, detector:BaseDetector, cfg:dict):
+        """Create the front-end from the camera config
+
+        Args:
+            detector (BaseDetector): The detector.
+            cfg (dict): Camera config as a dictionary with the optional 'roi' ('x, y, width, height' regions separated by ';'), 'tile', 'tile_overlap', 'letterbox' and 'resolution' ('width, height') keys.
+
+        Returns:
+            RegionDetector: The front-end
+        """
+        # utils imports this module, so it is only imported once the module is loaded
+        import utils
+        rois = [tuple(int(i) for i in roi.split(',')) for roi in cfg.get('roi', '').split(';') if roi.strip()]
+        resolution = tuple(int(i) for i in cfg['resolution'].split(',')) if cfg.get('resolution', '').strip() else None
+        return cls(detector, rois=rois or None, tile=int(cfg.get('tile') or 0), overlap=float(cfg.get('tile_overlap') or 0.2),
+                   letterbox=utils.getboolean(cfg, 'letterbox'), resolution=resolution)
+
+    def views(self, shape:tuple):
+        """Get the regions of the frame the detector runs on
+
+        Args:
+            shape (tuple): Shape of the frame.
+
+        Returns:
+            list: (x, y, width, height) pixel regions, clipped to the frame
+        """
+        if shape not in self._views:
+            height, width = shape[:2]
+            views = []
+            for x, y, w, h in self.rois or [(0, 0, width, height)]:
+                x, y = min(max(x, 0), width - 1), min(max(y, 0), height - 1)
+                w, h = min(w, width - x), min(h, height - y)
+                for tx, tw in self._tiles(x, w):
+                    for ty, th in self._tiles(y, h):
+                        views.append((tx, ty, tw, th))
+            self._views[shape] = views
+        return self._views[shape]
+
+    def inputshapes(self):
+        """Get the input shapes the detector will see, for warming it up
+
+        Returns:
+            list: (height, width, 3) shapes, empty if they depend on the unknown frame resolution
+        """
+        if self.letterbox:
+            return [(INPUT_SIZE, INPUT_SIZE, 3)]
+        if self.resolution is None:
+            return []
+        width, height = self.resolution
+        return sorted({(h, w, 3) for _, _, w, h in self.views((height, width, 3))})
+
+    def _tiles(self, start:int, length:int):
+        """Split a range into overlapping tiles of at most 'tile' pixels
+
+        Args:
+            start (int): Start of the range.
+            length (int): Length of the range.
+
+        Returns:
+            list: (start, length) of the tiles
+        """
+        if not self.tile or length <= self.tile:
+            return [(start, length)]
+        step = self.tile * (1 - self.overlap)
+        count = int(np.ceil((length - self.tile) / step)) + 1
+        return [(start + int(round(offset)), self.tile) for offset in np.linspace(0, length - self.tile, count)]
+
+    def split(self, frame:np.ndarray, index:int=0):
+        """Cut the frame into the model inputs of its views
+
+        Args:
+            frame (np.ndarray): The frame.
+            index (int, optional): Position of the frame in its batch. Letterboxed inputs are written into buffers kept per frame shape and position, they stay valid until the next frame at the same position. Defaults to 0.
+
+        Returns:
+            tuple: (images, views), the images are square model inputs if letterboxed and the region crops otherwise
+        """
+        views = self.views(frame.shape)
+        if len(views) == 1 and not self.letterbox and views[0][2:] == (frame.shape[1], frame.shape[0]):
+            return [frame], views
+        if not self.letterbox:
+            return [frame[y:y + h, x:x + w] for x, y, w, h in views], views
+        key = (frame.shape, frame.dtype.str, index)
+        if key not in self._canvases:
+            # the padding stays black, every view fills the same top left part on each frame
+            self._canvases[key] = np.zeros((len(views), INPUT_SIZE, INPUT_SIZE) + frame.shape[2:], dtype=frame.dtype)
+        images = self._canvases[key]
+        for image, (x, y, w, h) in zip(images, views):
+            scale = INPUT_SIZE / max(w, h)
+            width, height = max(1, round(w * scale)), max(1, round(h * scale))
+            cv2.resize(frame[y:y + h, x:x + w], (width, height), dst=image[:height, :width])
+        return list(images), views
+
+    def merge(self, detections:list, views:list, shape:tuple):
+        """Map the detections of the views back to the frame and suppress the duplicates of overlapping views
+
+        Args:
+            detections (list): Detections of every view, as returned by the detector.
+            views (list): The views, as returned by 'split'.
+            shape (tuple): Shape of the frame.
+
+        Returns:
+            dict: Detections of the frame in the format of the detector, best first if several views were merged
+        """
+        height, width = shape[:2]
+        allscores, allboxes = [], []
+        for detection, (x, y, w, h) in zip(detections, views):
+            scores = np.asarray(detection['detection_scores'][0], dtype=np.float32)
+            boxes = np.asarray(detection['detection_boxes'][0], dtype=np.float32).reshape(-1, 4)
+            if len(views) > 1:
+                boxes, scores = boxes[scores >= self.min_score], scores[scores >= self.min_score]
+            if self.letterbox:
+                # the region fills the top left of the square input
+                side = max(w, h)
+                boxes = np.clip(boxes * side, 0, [h, w, h, w])
+            else:
+                boxes = boxes * [h, w, h, w]
+            allboxes.append((boxes + [y, x, y, x]) / [height, width, height, width])
+            allscores.append(scores)
+        scores, boxes = np.concatenate(allscores), np.concatenate(allboxes).astype(np.float32)
+        if len(views) > 1:
+            keep = nms(boxes, scores, self.nms_threshold, overlap='min')
+            scores, boxes = scores[keep], boxes[keep]
+        return {'detection_scores':scores[np.newaxis], 'detection_boxes':boxes[np.newaxis]}
+
+    def __call__(self, frame:np.ndarray):
+        return self.batch([frame])[0]
+
+    def batch(self, frames:list):
+        """Detect license plates in several frames, the views of all frames are detected as one batch
+
+        Args:
+            frames (list): Frames to be processed.
+
+        Returns:
+            list: Detections of every frame in the format of the detector
+        """
+        return detectregions(self.detector, [self] * len(frames), frames)
+
+def detectregions(detector:BaseDetector, regions:list, frames:list):
+    """Detect license plates in the frames of several cameras, the views of all frames are detected with one detector call.
+    Every frame is split at its position in the batch, so frames of the same camera do not share letterbox buffers
+
+    Args:
+        detector (BaseDetector): The detector of the front-ends.
+        regions (list): RegionDetector of every frame, the frames of a camera share theirs.
+        frames (list): The frames.
+
+    Returns:
+        list: Detections of every frame in full frame coordinates
+    """
+    splits = [region.split(frame, index) for index, (region, frame) in enumerate(zip(regions, frames))]
+    detections = detector.batch([image for images, _ in splits for image in images])
+    results, start = [], 0
+    for region, frame, (images, views) in zip(regions, frames, splits):
+        results.append(region.merge(detections[start:start + len(images)], views, frame.shape))
+        start += len(images)
+    return results
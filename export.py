@@ -0,0 +1,326 @@
+import argparse
+import os
+from glob import glob
+from time import perf_counter
+import xml.etree.ElementTree as ET
+import zlib
+import numpy as np
+import cv2
+
+SELFDIR = os.path.abspath(f'{__file__}/..')
+
+# quantized variants of the lite model, selected with 'model_type = lite-<variant>'
+VARIANTS = ('dynamic', 'float16', 'int8')
+# fraction of the labelled plates held out from the recognizer training to evaluate it on, see splitplates
+PLATE_HOLDOUT = 0.25
+
+import detectors
+import tracker
+
+
+def representative_dataset(directory:str, count:int=100):
+    """Calibration inputs for the int8 conversion, preprocessed like LiteDetector does
+
+    Args:
+        directory (str): Directory with the images.
+        count (int, optional): Number of images. Defaults to 100.
+
+    Returns:
+        Callable: Generator function yielding single image input lists
+    """
+    paths = sorted(glob(f"{directory}/*.jpg"))[:count]
+    def generator():
+        buffer = np.empty((1, 640, 640, 3), dtype=np.float32)
+        for path in paths:
+            if (img := cv2.imread(path)) is not None:
+                detectors.preprocess(img, buffer[0])
+                yield [buffer]
+    return generator
+
+def convert(source:str, variant:str, calibration:str=None):
+    """Convert the SavedModel to a quantized lite model
+
+    Args:
+        source (str): SavedModel directory.
+        variant (str): One of VARIANTS.
+        calibration (str, optional): Image directory of the representative dataset, needed for 'int8'. Defaults to None.
+
+    Returns:
+        bytes: The lite model
+    """
+    import tensorflow as tf
+    converter = tf.lite.TFLiteConverter.from_saved_model(source)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    # the detection post processing is a custom op
+    converter.allow_custom_ops = True
+    if variant == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif variant == 'int8':
+        # integer weights and activations, the inputs and outputs stay float so the preprocessing does not change
+        converter.representative_dataset = representative_dataset(calibration)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    return converter.convert()
+
+def convert_onnx(model:str, output:str, opset:int=13):
+    """Convert a lite model to ONNX for the 'onnx' and 'opencv' detector backends, keeping its NHWC float input
+
+    Args:
+        model (str): Path of the lite model.
+        output (str): Path of the ONNX model.
+        opset (int, optional): ONNX opset. Defaults to 13.
+    """
+    import tf2onnx
+    tf2onnx.convert.from_tflite(model, opset=opset, output_path=output)
+
+def build_recognizer(alphabet:str, height:int=32, width:int=128, channels:int=3):
+    """Build a small convolutional CTC plate recognizer with the input and output layout of worker.CtcRecognizer.
+    It has no recurrent layers, so it converts to a fully integer quantized lite model
+
+    Args:
+        alphabet (str): Characters in the order of the output classes, the CTC blank is the last class.
+        height (int, optional): Input height. Defaults to 32.
+        width (int, optional): Input width, the model has width / 4 time steps. Defaults to 128.
+        channels (int, optional): Input channels. Defaults to 3.
+
+    Returns:
+        keras.Model: The model, (batch, height, width, channels) images scaled to [0, 1] to (batch, time steps, len(alphabet) + 1) probabilities
+    """
+    from tensorflow import keras
+    inputs = keras.Input((height, width, channels))
+    x = inputs
+    for filters, pool in ((32, (2, 2)), (64, (2, 2)), (128, (2, 1)), (128, (2, 1))):
+        x = keras.layers.Conv2D(filters, 3, padding='same', use_bias=False)(x)
+        x = keras.layers.BatchNormalization()(x)
+        x = keras.layers.ReLU()(x)
+        x = keras.layers.MaxPooling2D(pool)(x)
+    # one feature vector per column of the line
+    x = keras.layers.Permute((2, 1, 3))(x)
+    x = keras.layers.Reshape((width // 4, (height // 16) * 128))(x)
+    x = keras.layers.Conv1D(128, 3, padding='same', activation='relu')(x)
+    outputs = keras.layers.Dense(len(alphabet) + 1, activation='softmax')(x)
+    return keras.Model(inputs, outputs)
+
+def train_recognizer(plates:list, alphabet:str, epochs:int=200, batch_size:int=16, height:int=32, width:int=128):
+    """Train the plate recognizer on labelled plate crops with the CTC loss
+
+    Args:
+        plates (list): (crop, label) pairs, see loadplates. Characters of the labels missing from the alphabet are left out.
+        alphabet (str): Characters of the model, see build_recognizer.
+        epochs (int, optional): Passes over the crops. Defaults to 200.
+        batch_size (int, optional): Crops per training step. Defaults to 16.
+        height (int, optional): Input height. Defaults to 32.
+        width (int, optional): Input width. Defaults to 128.
+
+    Returns:
+        tuple: (model, images), the trained keras.Model and the preprocessed crops, e.g. for the int8 calibration
+    """
+    import tensorflow as tf
+    model = build_recognizer(alphabet, height, width)
+    # preprocessed like worker.CtcRecognizer does
+    images = np.stack([cv2.resize(crop, (width, height), interpolation=cv2.INTER_AREA) for crop, _ in plates]).astype(np.float32) / 255
+    labels = [[alphabet.index(c) for c in label if c in alphabet] for _, label in plates]
+    lengths = np.array([len(label) for label in labels], dtype=np.int32)
+    dense = np.zeros((len(labels), max(lengths)), dtype=np.int32)
+    for i, label in enumerate(labels):
+        dense[i, :len(label)] = label
+    dataset = tf.data.Dataset.from_tensor_slices((images, dense, lengths)).shuffle(len(images)).batch(batch_size)
+    optimizer = tf.keras.optimizers.Adam(1e-3)
+    steps = width // 4
+    for epoch in range(epochs):
+        total = 0.0
+        for x, y, n in dataset:
+            with tf.GradientTape() as tape:
+                probabilities = model(x, training=True)
+                loss = tf.reduce_mean(tf.nn.ctc_loss(y, tf.math.log(probabilities + 1e-7), n, tf.fill([tf.shape(x)[0]], steps), logits_time_major=False, blank_index=-1))
+            optimizer.apply_gradients(zip(tape.gradient(loss, model.trainable_variables), model.trainable_variables))
+            total += float(loss)
+        if (epoch + 1) % 20 == 0:
+            print(f"Epoch {epoch + 1}: CTC loss {total / len(dataset):.3f}")
+    return model, images
+
+def convert_recognizer(model, images:np.ndarray=None):
+    """Convert the plate recognizer to a lite model for worker.CtcRecognizer
+
+    Args:
+        model (keras.Model): The recognizer, see build_recognizer.
+        images (np.ndarray, optional): Preprocessed crops calibrating an int8 model with int8 inputs and outputs. A float model if None. Defaults to None.
+
+    Returns:
+        bytes: The lite model
+    """
+    import tensorflow as tf
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if images is not None:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([image[np.newaxis]] for image in images[:100])
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = converter.inference_output_type = tf.int8
+    return converter.convert()
+
+def loadlabels(directory:str):
+    """Load the Pascal VOC plate annotations
+
+    Args:
+        directory (str): Directory with the .xml annotations.
+
+    Returns:
+        dict: Image file name to a list of normalized (ymin, xmin, ymax, xmax) boxes
+    """
+    labels = {}
+    for path in glob(f"{directory}/*.xml"):
+        root = ET.parse(path).getroot()
+        width, height = float(root.find('size/width').text), float(root.find('size/height').text)
+        boxes = []
+        for box in root.iter('bndbox'):
+            xmin, xmax, ymin, ymax = (float(box.find(key).text) for key in ('xmin', 'xmax', 'ymin', 'ymax'))
+            boxes.append((ymin / height, xmin / width, ymax / height, xmax / width))
+        labels[root.find('filename').text] = boxes
+    return labels
+
+def loadplates(directory:str, labels:str, limit:int=None, margin:float=0.1):
+    """Load the labelled plates. The images are full frames named after the plate (e.g. '<image>.jpg#FC3JZF.jpg'),
+    every frame is cropped to its largest annotated plate, which is the labelled one
+
+    Args:
+        directory (str): Directory with the labelled frames.
+        labels (str): Directory with the Pascal VOC annotations of the frames, see loadlabels.
+        limit (int, optional): Maximum number of frames. Defaults to None.
+        margin (float, optional): Padding around the plate as a fraction of its width and height, like the crops of the workers. Defaults to 0.1.
+
+    Returns:
+        list: (crop, label) of the frames with a non-empty label and an annotated plate
+    """
+    annotations = loadlabels(labels)
+    plates = []
+    for path in sorted(glob(f"{directory}/*#*"))[:limit]:
+        name, _, label = os.path.basename(path).rpartition('#')
+        label = label.rpartition('.')[0].upper()
+        if not label or not (boxes := annotations.get(name)) or (img := cv2.imread(path)) is None:
+            continue
+        ymin, xmin, ymax, xmax = max(boxes, key=lambda box: (box[2] - box[0]) * (box[3] - box[1]))
+        pady, padx = (ymax - ymin) * margin, (xmax - xmin) * margin
+        height, width = img.shape[:2]
+        y1, y2 = (int(np.clip(round(y * height), 0, height)) for y in (ymin - pady, ymax + pady))
+        x1, x2 = (int(np.clip(round(x * width), 0, width)) for x in (xmin - padx, xmax + padx))
+        if y2 > y1 and x2 > x1:
+            plates.append((img[y1:y2, x1:x2], label))
+    return plates
+
+def splitplates(plates:list, holdout:float=PLATE_HOLDOUT):
+    """Split the labelled plates into a training and an evaluation set. The set of a plate only depends on a hash of its label,
+    so the split is the same in every run and for every subset of the plates, and a plate seen in training is never evaluated
+
+    Args:
+        plates (list): (crop, label) pairs, see loadplates.
+        holdout (float, optional): Approximate fraction of the plates in the evaluation set. Defaults to PLATE_HOLDOUT.
+
+    Returns:
+        tuple: (crop, label) pairs of the training and of the evaluation set
+    """
+    train, evaluation = [], []
+    for crop, label in plates:
+        (evaluation if zlib.crc32(label.encode()) % 1000 < holdout * 1000 else train).append((crop, label))
+    return train, evaluation
+
+def evaluate(model:str, images:str, labels:dict, threshold:float=0.2, iou:float=0.5, limit:int=None, backend:str='lite', camera:dict=None):
+    """Measure the box recall and detection latency of a model
+
+    Args:
+        model (str): Path of the model.
+        images (str): Image directory.
+        labels (dict): Annotations, see loadlabels.
+        threshold (float, optional): Detection score threshold, as used by the worker. Defaults to 0.2.
+        iou (float, optional): Minimum IoU of a detection with an annotated plate to count it as found. Defaults to 0.5.
+        limit (int, optional): Maximum number of images. Defaults to None.
+        backend (str, optional): Detector backend running the model, see detectors.BACKENDS. Defaults to 'lite'.
+        camera (dict, optional): Camera config of the detection front-end, as the workers run it, see detectors.RegionDetector.fromcfg. Defaults to None.
+
+    Returns:
+        dict: 'recall', 'p50' and 'p95' latency in ms and 'size' of the model in MB
+    """
+    detector = detectors.RegionDetector.fromcfg(detectors.BACKENDS[backend](model), camera or {})
+    found, total, times = 0, 0, []
+    for name, boxes in sorted(labels.items())[:limit]:
+        if (img := cv2.imread(f"{images}/{name}")) is None:
+            continue
+        start = perf_counter()
+        detections = detector(img)
+        times.append((perf_counter() - start) * 1000)
+        scores = np.asarray(detections['detection_scores'][0])
+        detected = np.asarray(detections['detection_boxes'][0])[scores >= threshold]
+        total += len(boxes)
+        found += sum(any(tracker.iou(np.asarray(box), candidate) >= iou for candidate in detected) for box in boxes)
+    p50, p95 = np.percentile(times, [50, 95]) if times else (0.0, 0.0)
+    return {'recall':found / total if total else 0.0, 'p50':p50, 'p95':p95, 'size':os.path.getsize(model) / 2 ** 20}
+
+def report(results:dict):
+    """Format the evaluation results as a markdown table
+
+    Args:
+        results (dict): Variant name to the result of evaluate.
+
+    Returns:
+        str: The report
+    """
+    lines = ["| model | size (MB) | box recall | p50 (ms) | p95 (ms) |", "|---|---|---|---|---|"]
+    for name, result in results.items():
+        lines.append(f"| {name} | {result['size']:.1f} | {result['recall']:.3f} | {result['p50']:.1f} | {result['p95']:.1f} |")
+    return '\n'.join(lines) + '\n'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export quantized lite models and compare their speed and accuracy")
+    parser.add_argument('--source', default=f"{SELFDIR}/saved_model/lite_saved", help="SavedModel to convert. Defaults to saved_model/lite_saved.")
+    parser.add_argument('--output', default=f"{SELFDIR}/saved_model", help="Directory of the lite models. Defaults to saved_model.")
+    parser.add_argument('--variants', nargs='+', choices=VARIANTS, default=list(VARIANTS), help="Variants to export. Defaults to all.")
+    parser.add_argument('--onnx', action='store_true', help="Also convert model.tflite to model.onnx for the onnx and opencv backends, needs tf2onnx.")
+    parser.add_argument('--calibration', default=f"{SELFDIR}/LP_Detection/train", help="Representative images for int8. Defaults to LP_Detection/train.")
+    parser.add_argument('--images', default=f"{SELFDIR}/LP_Detection/valid", help="Evaluation images. Defaults to LP_Detection/valid.")
+    parser.add_argument('--labels', default=f"{SELFDIR}/LP_Detection/validlabels", help="Evaluation annotations. Defaults to LP_Detection/validlabels.")
+    parser.add_argument('--limit', type=int, help="Maximum number of evaluation images. Defaults to all.")
+    parser.add_argument('--recognizer', action='store_true', help="Also train the ctc plate recognizer on the training set of the labelled plates (see splitplates) and export saved_model/plate_ocr.tflite and plate_ocr_int8.tflite.")
+    parser.add_argument('--plates', default=f"{SELFDIR}/LP_Detection/trainlps", help="Frames named after their plate to train the recognizer on. Defaults to LP_Detection/trainlps.")
+    parser.add_argument('--plate-labels', default=f"{SELFDIR}/LP_Detection/trainlabels", help="Plate annotations of the recognizer training frames. Defaults to LP_Detection/trainlabels.")
+    parser.add_argument('--epochs', type=int, default=200, help="Recognizer training epochs. Defaults to 200.")
+    parser.add_argument('--report', default=f"{SELFDIR}/saved_model/quantization_report.md", help="Report file. Defaults to saved_model/quantization_report.md.")
+    args = parser.parse_args()
+
+    for variant in args.variants:
+        print(f"Converting {variant}")
+        try:
+            model = convert(args.source, variant, args.calibration)
+        except Exception as e:
+            print(f"Conversion to {variant} failed: {e}")
+            continue
+        with open(detectors.LiteDetector.modelpath(args.output, variant), 'wb') as f:
+            f.write(model)
+
+    if args.onnx:
+        print("Converting to ONNX")
+        try:
+            convert_onnx(detectors.LiteDetector.modelpath(args.output), detectors.OnnxDetector.modelpath(args.output))
+        except Exception as e:
+            print(f"Conversion to ONNX failed: {e}")
+
+    if args.recognizer:
+        from worker import PLATE_ALPHABET
+        train, evaluation = splitplates(loadplates(args.plates, args.plate_labels))
+        print(f"Training the plate recognizer on {len(train)} plate(s), {len(evaluation)} held out for benchmark.py recognizers")
+        model, images = train_recognizer(train, PLATE_ALPHABET, args.epochs)
+        for name, calibration in (('plate_ocr', None), ('plate_ocr_int8', images)):
+            with open(f"{args.output}/{name}.tflite", 'wb') as f:
+                f.write(convert_recognizer(model, calibration))
+
+    labels = loadlabels(args.labels)
+    results = {}
+    for variant in ['', *args.variants]:
+        if os.path.exists(path := detectors.LiteDetector.modelpath(args.output, variant)):
+            print(f"Evaluating {os.path.basename(path)}")
+            results[f"lite-{variant}" if variant else "lite"] = evaluate(path, args.images, labels, limit=args.limit)
+    if args.onnx and detectors.OnnxDetector.installed() and os.path.exists(path := detectors.OnnxDetector.modelpath(args.output)):
+        print(f"Evaluating {os.path.basename(path)}")
+        results["onnx"] = evaluate(path, args.images, labels, limit=args.limit, backend='onnx')
+    text = report(results)
+    with open(args.report, 'w') as f:
+        f.write(text)
+    print(text)
@@ -0,0 +1,506 @@
+import multiprocessing as mp
+from multiprocessing import shared_memory, resource_tracker
+from contextlib import contextmanager
+from dataclasses import dataclass
+from time import time, sleep
+import numpy as np
+
+# layout of the shared memory block:
+# | buffer header | slot 0 header | slot 0 frame | slot 1 header | slot 1 frame | ...
+MAGIC = 0x4C505246  # 'LPRF'
+BUFFER_HEADER = np.dtype([('magic', '<u4'), ('slots', '<u4'), ('capacity', '<u8'), ('latest', '<u8'), ('consumed', '<u8'), ('dropped', '<u8'), ('expired', '<u8'), ('_pad', '<u8', 2)])
+SLOT_HEADER = np.dtype([('seq', '<u8'), ('timestamp', '<f8'), ('shape', '<u4', 3), ('_pad', '<u4')])
+# seconds a claim waits for the ready set lock before it checks whether the holder died with it
+LOCK_TIMEOUT = 1.0
+
+
+def buffer_name(prefix:str, cam_id:int):
+    """Get the shared memory name of a camera frame buffer
+
+    Args:
+        prefix (str): Prefix unique to the running system, e.g. 'lpr{pid of the main process}'.
+        cam_id (int): Camera ID.
+
+    Returns:
+        str: Shared memory block name
+    """
+    return f"{prefix}_cam{cam_id}"
+
+
+@dataclass
+class FrameRef:
+    """Reference to a frame stored in a FrameRingBuffer. Sent between processes instead of the frame itself
+    """
+    name: str
+    slot: int
+    seq: int
+    timestamp: float = 0.0
+
+
+class FrameRingBuffer:
+    """Ring buffer of frames in shared memory. A single writer (the camera process) publishes frames,
+    any number of readers (workers, GUI preview, the task distributor) read them by slot index.
+
+    Every slot header carries a sequence number, which is cleared while the slot is being written to.
+    Readers check the sequence number before and after copying the frame, so a frame overwritten during the read is never returned.
+    """
+    def __init__(self, shm:shared_memory.SharedMemory, owner=False):
+        """Wrap an existing shared memory block. Use FrameRingBuffer.create or FrameRingBuffer.attach instead.
+
+        Args:
+            shm (shared_memory.SharedMemory): Shared memory block holding the buffer.
+            owner (bool, optional): The buffer was created by this process and will be unlinked on close. Defaults to False.
+        """
+        self._shm = shm
+        self.owner = owner
+        self.name = shm.name
+        self._header = np.ndarray((), dtype=BUFFER_HEADER, buffer=shm.buf)
+        self.slots = int(self._header['slots'])
+        self.capacity = int(self._header['capacity'])
+        self._slotsize = SLOT_HEADER.itemsize + self.capacity
+        self._slotheaders = [np.ndarray((), dtype=SLOT_HEADER, buffer=shm.buf, offset=self._offset(i)) for i in range(self.slots)]
+        self._slotdata = [np.ndarray((self.capacity,), dtype=np.uint8, buffer=shm.buf, offset=self._offset(i) + SLOT_HEADER.itemsize) for i in range(self.slots)]
+
+    def _offset(self, slot:int):
+        return BUFFER_HEADER.itemsize + slot * self._slotsize
+
+    @classmethod
+    def create(cls, name:str, shape:tuple, slots=4):
+        """Create a new frame buffer in shared memory, replacing a stale one with the same name
+
+        Args:
+            name (str): Shared memory block name.
+            shape (tuple): Largest frame shape (height, width, channels) the buffer has to hold.
+            slots (int, optional): Number of frames held at once. Defaults to 4.
+
+        Returns:
+            FrameRingBuffer: The created buffer
+        """
+        capacity = int(np.prod(shape))
+        size = BUFFER_HEADER.itemsize + slots * (SLOT_HEADER.itemsize + capacity)
+        try:
+            shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            # left over from a previous camera process, the readers will re-attach on the magic check
+            stale = shared_memory.SharedMemory(name)
+            np.ndarray((), dtype=BUFFER_HEADER, buffer=stale.buf)['magic'] = 0
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name, create=True, size=size)
+        header = np.ndarray((), dtype=BUFFER_HEADER, buffer=shm.buf)
+        header['slots'] = slots
+        header['capacity'] = capacity
+        header['latest'] = 0
+        header['consumed'] = 0
+        header['dropped'] = 0
+        header['expired'] = 0
+        buffer = cls(shm, owner=True)
+        # the magic number is written last, marking the buffer as ready
+        header['magic'] = MAGIC
+        return buffer
+
+    @classmethod
+    def attach(cls, name:str):
+        """Attach to an existing frame buffer
+
+        Args:
+            name (str): Shared memory block name.
+
+        Raises:
+            FileNotFoundError: The buffer does not exist (yet).
+
+        Returns:
+            FrameRingBuffer: The attached buffer
+        """
+        try:
+            shm = shared_memory.SharedMemory(name, track=False)
+        except TypeError:
+            # python < 3.13, stop the resource tracker from unlinking the block when this process exits
+            shm = shared_memory.SharedMemory(name)
+            resource_tracker.unregister(shm._name, 'shared_memory')
+            shm._untracked = True
+        if np.ndarray((), dtype=BUFFER_HEADER, buffer=shm.buf)['magic'] != MAGIC:
+            shm.close()
+            raise FileNotFoundError(f"Frame buffer {name} is not initialized")
+        return cls(shm)
+
+    @property
+    def valid(self):
+        """False once the owner replaced the buffer with a new one, readers should re-attach"""
+        return self._header['magic'] == MAGIC
+
+    def write(self, frame:np.ndarray, timestamp:float=None):
+        """Publish a frame, overwriting the oldest one
+
+        Args:
+            frame (np.ndarray): Frame to publish.
+            timestamp (float, optional): Capture time of the frame. Defaults to the current time.
+
+        Raises:
+            ValueError: The frame does not fit into a slot.
+
+        Returns:
+            FrameRef: Reference to the published frame
+        """
+        if frame.nbytes > self.capacity:
+            raise ValueError(f"Frame of shape {frame.shape} does not fit into the buffer {self.name}")
+        seq = int(self._header['latest']) + 1
+        slot = seq % self.slots
+        header = self._slotheaders[slot]
+        header['seq'] = 0
+        self._slotdata[slot][:frame.nbytes] = np.ascontiguousarray(frame, dtype=np.uint8).reshape(-1)
+        timestamp = time() if timestamp is None else timestamp
+        header['timestamp'] = timestamp
+        header['shape'] = (frame.shape + (1, 1))[:3]
+        header['seq'] = seq
+        self._header['latest'] = seq
+        return FrameRef(self.name, slot, seq, timestamp)
+
+    @property
+    def pending(self):
+        """True while the newest frame was not taken by any consumer yet"""
+        return self._header['latest'] > self._header['consumed']
+
+    def consume(self, ref:FrameRef):
+        """Mark a frame as taken, signalling the camera that a newer frame is wanted
+
+        Args:
+            ref (FrameRef): Reference to the taken frame.
+        """
+        if ref.seq > self._header['consumed']:
+            self._header['consumed'] = ref.seq
+
+    @property
+    def dropped(self):
+        """Number of frames the camera received but never decoded or published"""
+        return int(self._header['dropped'])
+
+    @dropped.setter
+    def dropped(self, value:int):
+        self._header['dropped'] = value
+
+    @property
+    def expired(self):
+        """Number of frames dropped by the workers for being older than the camera deadline"""
+        return int(self._header['expired'])
+
+    def expire(self, ref:FrameRef):
+        """Consume a frame without processing it, counting it as expired
+
+        Args:
+            ref (FrameRef): Reference to the expired frame.
+        """
+        self.consume(ref)
+        self._header['expired'] += 1
+
+    def latest(self):
+        """Get a reference to the newest frame
+
+        Returns:
+            FrameRef: Newest frame, None if no frame was published yet
+        """
+        seq = int(self._header['latest'])
+        if seq == 0:
+            return None
+        return FrameRef(self.name, seq % self.slots, seq, float(self._slotheaders[seq % self.slots]['timestamp']))
+
+    def read(self, ref:FrameRef):
+        """Copy a frame out of the buffer
+
+        Args:
+            ref (FrameRef): Reference to the frame.
+
+        Returns:
+            tuple: (frame, timestamp), None if the frame was already overwritten
+        """
+        header = self._slotheaders[ref.slot]
+        if header['seq'] != ref.seq:
+            return None
+        shape = tuple(int(i) for i in header['shape'])
+        timestamp = float(header['timestamp'])
+        frame = self._slotdata[ref.slot][:int(np.prod(shape))].reshape(shape).copy()
+        if header['seq'] != ref.seq:
+            return None
+        return frame, timestamp
+
+    def close(self):
+        """Detach from the buffer, the owner also unlinks it unless it was already replaced.
+        The owner clears the magic number first, so attached readers notice the buffer is gone and re-attach to its replacement
+        """
+        unlink = self.owner and self.valid
+        if unlink:
+            self._header['magic'] = 0
+        self._slotheaders = self._slotdata = self._header = None
+        self._shm.close()
+        if unlink:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+
+    def unlink(self):
+        """Remove the buffer from the system, used by the main process on shutdown
+        """
+        if getattr(self._shm, '_untracked', False):
+            # SharedMemory.unlink unregisters the block from the resource tracker, which attach already did
+            resource_tracker.register(self._shm._name, 'shared_memory')
+        try:
+            self._shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class BufferReader:
+    """Per-process cache of attached frame buffers, resolving FrameRefs to frames
+    """
+    def __init__(self):
+        self._buffers = {}
+
+    def get(self, name:str):
+        """Get an attached buffer, attaching to it on first use
+
+        Args:
+            name (str): Shared memory block name.
+
+        Returns:
+            FrameRingBuffer: Attached buffer, None if it does not exist yet
+        """
+        buffer = self._buffers.get(name)
+        if buffer is not None and not buffer.valid:
+            # the camera process recreated the buffer
+            buffer.close()
+            buffer = None
+        if buffer is None:
+            try:
+                buffer = FrameRingBuffer.attach(name)
+            except FileNotFoundError:
+                self._buffers.pop(name, None)
+                return None
+            self._buffers[name] = buffer
+        return buffer
+
+    def read(self, ref:FrameRef):
+        """Copy the referenced frame out of its buffer
+
+        Args:
+            ref (FrameRef): Reference to the frame.
+
+        Returns:
+            tuple: (frame, timestamp), None if the frame is no longer available
+        """
+        buffer = self.get(ref.name)
+        if buffer is None:
+            return None
+        return buffer.read(ref)
+
+    def close(self):
+        for buffer in self._buffers.values():
+            buffer.close()
+        self._buffers = {}
+
+
+class ReadySet:
+    """Set of camera frame buffers shared by the workers. Idle workers pull the freshest frame of a camera from it,
+    the camera with the highest waiting time multiplied by its priority goes first.
+    Frames older than the deadline of their camera are dropped instead of being processed.
+
+    Cameras call 'notify' after publishing a frame, waking up the waiting workers.
+    Workers which find no frame ask the cameras for one with 'request', cameras only decode a frame once asked, so it is fresh when it is claimed.
+    """
+    def __init__(self, names:list, priorities:list=None, max_ages:list=None, lock=None, event=None, requests:list=None, holder=None):
+        """Initialize the ready set
+
+        Args:
+            names (list): Shared memory names of the camera frame buffers, indexed by camera ID.
+            priorities (list, optional): Priority weight of every camera. Defaults to 1 for all cameras.
+            max_ages (list, optional): Deadline of every camera in seconds since capture, 0 for no deadline. Defaults to no deadlines.
+            lock (mp.Lock, optional): Lock making claims atomic between processes. Created if not provided.
+            holder (mp.Value, optional): Counter of the lock acquisitions, which tells a live holder from a dead one. Created if not provided.
+            event (mp.Event, optional): Event set by the cameras on a new frame. Created if not provided.
+            requests (list, optional): Events set by the workers to ask every camera for a new frame. Created if not provided.
+        """
+        self.names = list(names)
+        self.priorities = list(priorities) if priorities is not None else [1.0] * len(self.names)
+        self.max_ages = list(max_ages) if max_ages is not None else [0.0] * len(self.names)
+        self.lock = lock if lock is not None else mp.Lock()
+        self.holder = holder if holder is not None else mp.Value('Q', 0)
+        self.event = event if event is not None else mp.Event()
+        self.requests = list(requests) if requests is not None else [mp.Event() for _ in self.names]
+        self._reader = BufferReader()
+
+    def __getstate__(self):
+        # attached buffers are per process
+        return {'names':self.names, 'priorities':self.priorities, 'max_ages':self.max_ages, 'lock':self.lock, 'event':self.event, 'requests':self.requests, 'holder':self.holder}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def notify(self):
+        """Signal the waiting workers that a new frame was published
+        """
+        self.event.set()
+
+    def request(self, name:str=None):
+        """Ask the cameras for a new frame
+
+        Args:
+            name (str, optional): Buffer name of the camera to ask. Asks all cameras if None. Defaults to None.
+        """
+        for event in self.requests if name is None else [self.requests[self.names.index(name)]]:
+            event.set()
+
+    def requested(self, name:str, timeout:float=None):
+        """Wait until a worker asks a camera for a new frame, taking the request
+
+        Args:
+            name (str): Buffer name of the camera.
+            timeout (float, optional): Seconds to wait. Waits indefinitely if None. Defaults to None.
+
+        Returns:
+            bool: A frame was requested
+        """
+        event = self.requests[self.names.index(name)]
+        if not event.wait(timeout):
+            return False
+        # cleared before the frame is decoded, a request arriving meanwhile asks for the next one
+        event.clear()
+        return True
+
+    @contextmanager
+    def _locked(self):
+        """Hold the claim lock. A lock held for LOCK_TIMEOUT seconds without a new acquisition belongs to a worker which was killed
+        within a claim (claims take microseconds), it is taken over instead of blocking all other workers forever.
+        """
+        seen = self.holder.value
+        while not self.lock.acquire(timeout=LOCK_TIMEOUT):
+            with self.holder.get_lock():
+                if self.holder.value == seen:
+                    # the lock stays acquired, this process is its holder now
+                    self.holder.value += 1
+                    break
+                seen = self.holder.value
+        else:
+            with self.holder.get_lock():
+                self.holder.value += 1
+        try:
+            yield
+        finally:
+            self.lock.release()
+
+    def _pending(self, expire=False):
+        """Get the newest frame of every camera which has one not taken yet
+
+        Args:
+            expire (bool, optional): Drop the frames past their deadline. Only call with the lock held. Defaults to False.
+
+        Returns:
+            list: (camera id, FrameRef, FrameRingBuffer, score) tuples, the score is the waiting time multiplied by the priority
+        """
+        pending = []
+        now = time()
+        for camid, name in enumerate(self.names):
+            buffer = self._reader.get(name)
+            if buffer is None or not buffer.pending or (ref := buffer.latest()) is None:
+                continue
+            age = now - ref.timestamp
+            if self.max_ages[camid] and age > self.max_ages[camid]:
+                if expire:
+                    buffer.expire(ref)
+                continue
+            pending.append((camid, ref, buffer, age * self.priorities[camid]))
+        return pending
+
+    def claim(self, timeout:float=None):
+        """Take the next frame, waiting for one if none is ready
+
+        Args:
+            timeout (float, optional): Seconds to wait. Waits indefinitely if None. Defaults to None.
+
+        Returns:
+            tuple: (camera id, FrameRef), None on timeout
+        """
+        end = None if timeout is None else time() + timeout
+        while True:
+            with self._locked():
+                # cleared before looking, so a frame published meanwhile sets it again and is not missed
+                self.event.clear()
+                if pending := self._pending(expire=True):
+                    camid, ref, buffer, _ = max(pending, key=lambda p: p[3])
+                    buffer.consume(ref)
+                    return camid, ref
+            self.request()
+            remaining = None if end is None else end - time()
+            if remaining is not None and remaining <= 0:
+                return None
+            self.event.wait(remaining)
+
+    def claimbatch(self, size:int, wait:float=0.0, timeout:float=None):
+        """Take up to 'size' frames, waiting at most 'wait' seconds after the first one for the rest
+
+        Args:
+            size (int): Maximum number of frames.
+            wait (float, optional): Seconds to wait for more frames once the first one was taken. Defaults to 0.
+            timeout (float, optional): Seconds to wait for the first frame. Waits indefinitely if None. Defaults to None.
+
+        Returns:
+            list: (camera id, FrameRef) tuples, empty on timeout
+        """
+        if (claimed := self.claim(timeout)) is None:
+            return []
+        batch = [claimed]
+        end = time() + wait
+        while len(batch) < size and (claimed := self.claim(max(0.0, end - time()))) is not None:
+            batch.append(claimed)
+        return batch
+
+    def backlog(self):
+        """Number of cameras with a frame waiting for a worker"""
+        return len(self._pending())
+
+    def read(self, ref:FrameRef):
+        """Copy a claimed frame out of its buffer, see BufferReader.read"""
+        return self._reader.read(ref)
+
+
+class BufferCapture:
+    """cv2.VideoCapture-like reader of the newest frames in a camera frame buffer, used by the GUI live feed.
+    Does not consume the frames, so the preview never takes a frame away from the workers.
+    """
+    def __init__(self, name:str, timeout=5):
+        """Initialize the reader
+
+        Args:
+            name (str): Shared memory block name.
+            timeout (int, optional): Seconds to wait for the camera to create the buffer. Defaults to 5.
+        """
+        self._reader = BufferReader()
+        self._name = name
+        self._lastseq = 0
+        end = time() + timeout
+        while self._reader.get(name) is None and time() < end:
+            sleep(0.1)
+
+    def isOpened(self):
+        return self._reader.get(self._name) is not None
+
+    def read(self):
+        """Get the newest frame, waits up to 100 ms for a new one before returning the last one again
+
+        Returns:
+            tuple: (ret, frame) like cv2.VideoCapture.read
+        """
+        buffer = self._reader.get(self._name)
+        if buffer is None:
+            return False, None
+        for _ in range(10):
+            ref = buffer.latest()
+            if ref is not None and ref.seq != self._lastseq:
+                break
+            sleep(0.01)
+        if ref is None or (result := buffer.read(ref)) is None:
+            return False, None
+        self._lastseq = ref.seq
+        return True, result[0]
+
+    def release(self):
+        self._reader.close()
@@ -11,21 +11,24 @@ import os
 
 import utils
 import dbmgr
+import framebuffer
 
 SELFDIR = os.path.abspath(f'{__file__}/..')
 
 class GUImgr:
     """GUI manager class for the main window
     """
-    def __init__(self, guiQueue:Queue=None, db=dbmgr.DatabaseHandler(f'{SELFDIR}/lp.csv'), overridequeue=Queue()):
+    def __init__(self, guiQueue:Queue=None, db=dbmgr.DatabaseHandler(f'{SELFDIR}/lp.csv'), overridequeue=Queue(), framebuffer_prefix:str=None):
         """Initialize the class and the GUI
 
         Args:
             guiQueue (Queue, optional): Logging queue for multiprocess communication. Defaults to None.
             db (dbmgr.DatabaseHandler, optional): Database handler for easier access to data and for easier overrides. Defaults to dbmgr.DatabaseHandler(f'{__file__}\..\lp.csv').
             mgr (manager.taskDistributor, optional): Parent class for access to its variables. Defaults to None.
+            framebuffer_prefix (str, optional): Prefix of the camera frame buffers, used by the live feed. Opens the camera streams directly if not set. Defaults to None.
         """
         self.app = QtWidgets.QApplication([])
+        self.framebuffer_prefix = framebuffer_prefix
         self.config = configparser.ConfigParser()
         self.config.read(f'{SELFDIR}/config.ini')
         self.DBmgr = db
@@ -691,6 +694,8 @@ class Camera(QtWidgets.QWidget):
         layout = QtWidgets.QHBoxLayout()
         cfg = {"protocol":"rtsp", "port":554, "login":"admin", "password":"admin", "ip":"127.0.0.1", "id":self.id}
         cfg |= {k:v for k, v in self.config.items(f'CAM_{self.id}')}
+        if self.manager.framebuffer_prefix is not None:
+            cfg['shm_name'] = framebuffer.buffer_name(self.manager.framebuffer_prefix, self.id)
         btn = QtWidgets.QPushButton("Live feed", clicked=lambda: self.manager.feedmgr.start(cfg) if self.manager.feedmgr.thread is None else self.manager.feedmgr.stop())
         btn.setMinimumWidth(75)
         layout.addWidget(btn)
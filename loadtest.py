@@ -0,0 +1,60 @@
+import argparse
+from configparser import ConfigParser
+import subprocess
+import tempfile
+import sys
+import os
+
+SELFDIR = os.path.abspath(f'{__file__}/..')
+
+def build_config(base:ConfigParser, num_cameras:int, source:str, pacing='realtime', loop=True, num_workers:int=None):
+    """Create a config with virtual cameras replaying the same source
+
+    Args:
+        base (ConfigParser): Config to take the general settings from.
+        num_cameras (int): Number of virtual cameras.
+        source (str): Video file or image directory to replay.
+        pacing (str, optional): Replay pacing, 'realtime', 'fast' or a frame rate. Defaults to 'realtime'.
+        loop (bool, optional): Loop the source. Defaults to True.
+        num_workers (int, optional): Override the number of workers, the pool is fixed to this size. Defaults to None.
+
+    Returns:
+        ConfigParser: The new config
+    """
+    config = ConfigParser()
+    for section in base.sections():
+        if not section.startswith('CAM_'):
+            config[section] = dict(base[section])
+    config['GENERAL']['num_cameras'] = str(num_cameras)
+    if num_workers is not None:
+        # a fixed pool, so the configured scaling range does not change the number of workers under test
+        for key in ('num_workers', 'min_workers', 'max_workers'):
+            config['GENERAL'][key] = str(num_workers)
+    protocol = 'dir' if os.path.isdir(source) else 'file'
+    for i in range(num_cameras):
+        config[f'CAM_{i}'] = {'protocol':protocol, 'path':os.path.abspath(source), 'pacing':pacing, 'loop':str(loop)}
+    return config
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the system with virtual cameras replaying a video file or an image directory")
+    parser.add_argument('-n', '--cameras', type=int, default=4, help="Number of virtual cameras. Defaults to 4.")
+    parser.add_argument('-w', '--workers', type=int, default=None, help="Number of workers. Defaults to the value in the config.")
+    parser.add_argument('-s', '--source', default=f"{SELFDIR}/LP_Detection/valid", help="Video file or image directory to replay. Defaults to LP_Detection/valid.")
+    parser.add_argument('-p', '--pacing', default='realtime', help="'realtime', 'fast' or a fixed frame rate. Defaults to 'realtime'.")
+    parser.add_argument('--no-loop', action='store_true', help="Stop each camera after the last frame.")
+    parser.add_argument('--config', default=f"{SELFDIR}/config.ini", help="Config to take the general settings from.")
+    args = parser.parse_args()
+
+    base = ConfigParser()
+    base.read(args.config)
+    config = build_config(base, args.cameras, args.source, args.pacing, not args.no_loop, args.workers)
+    with tempfile.NamedTemporaryFile('w', suffix='.ini', delete=False) as f:
+        config.write(f)
+    print(f"Starting {args.cameras} virtual camera(s) replaying {args.source} ({args.pacing})")
+    try:
+        subprocess.call([sys.executable, f"{SELFDIR}/manager.py", '--config', f.name])
+    except KeyboardInterrupt:
+        pass
+    finally:
+        os.remove(f.name)
@@ -1,9 +1,13 @@
 import multiprocessing as mp
 from sys import stdout
+import argparse
 from configparser import ConfigParser
 import logging
 from logging.handlers import QueueHandler, QueueListener
-from time import time, sleep
+from time import time
+from collections import deque
+import queue
+import numpy as np
 import os
 
 if __name__ == "__main__":
@@ -11,6 +15,20 @@ if __name__ == "__main__":
 
 SELFDIR = os.path.abspath(f'{__file__}/..')
 
+# seconds between latency / frame statistics log entries
+STATS_INTERVAL = 60
+# default seconds between worker pool scaling decisions
+SCALE_INTERVAL = 10
+# worker utilisation above which the pool grows, and below which (with one worker less) it shrinks
+SCALE_UP_UTILISATION = 0.85
+SCALE_DOWN_UTILISATION = 0.6
+# seconds without a heartbeat after which an idle worker counts as hung
+HEARTBEAT_TIMEOUT = 10
+# default seconds a worker may spend on one batch before it counts as hung
+TASK_DEADLINE = 30
+# consecutive workers dying before loading their models after which dead workers are not replaced anymore
+MAX_STARTUP_FAILURES = 3
+
 # TODO:
 #  - fix manual override (broken due to pickeling of entire taskManager object not being possible anymore, at least on windows?)
 #  - above fixed?
@@ -29,50 +47,58 @@ import utils
 
 import worker
 import camera
+import framebuffer
+import detectors
+import tracker
 import gui
 import dbmgr
 
 class taskDistributor:
     """Main class for the ANPR system. Will handle the camera and worker processes, as well as the GUI and the communication between the parts.
     """
-    def __init__(self, logger=logging.getLogger(), outputQueue=None, inputQueue=None, successCallback=lambda *_:None):
+    def __init__(self, logger=logging.getLogger(), outputQueue=None, successCallback=lambda *_:None):
         """Initialize the task distributor
 
         Args:
             logger (logging.Logger, optional): Logger to use. Defaults to logging.getLogger().
-            outputQueue (Namespace, optional): Will contain the worker output tasks as attributes in the following format "wkr_id{camera_id}". Creates Namespace if one is not provided.
-            inputQueue (Namespace, optional): Will contain the camera input tasks as attributes in the following format "cam_id{camera_id}". Creates Namespace if one is not provided.
+            outputQueue (mp.Queue, optional): Result queue shared by all the workers. Created if one is not provided.
         """
         self.config = config
         self.logger = logger
         self.loggerQueue = mp.Queue()
 
-        self.mpmanager = mp.Manager()
-        if inputQueue is None:
-            self.inQ = self.mpmanager.Namespace()
-        else:
-            self.inQ = inputQueue
-        self.inQ_nextidx = 0
-        for i in range(int(config['GENERAL']['NUM_CAMERAS'])):
-            self.inQ.__setattr__(f"cam_id{i}", [])
+        self.mpmanager = tracker.TrackerManager()
+        self.mpmanager.start()
+        # camera frames are exchanged through shared memory, idle workers pull them from the ready set themselves
+        self.framebuffer_prefix = f"lpr{os.getpid()}"
+        self.framebuffers = framebuffer.BufferReader()
+        camcfgs = [config[f'CAM_{i}'] for i in range(int(config['GENERAL']['NUM_CAMERAS']))]
+        self.inQ = framebuffer.ReadySet([framebuffer.buffer_name(self.framebuffer_prefix, i) for i in range(len(camcfgs))],
+                                        priorities=[float(cfg.get('priority') or 1) for cfg in camcfgs],
+                                        max_ages=[float(cfg.get('max_age') or 0) for cfg in camcfgs])
+        # per camera frame statistics: highest processed sequence number, number of processed frames and capture to decision latencies in ms
+        self.maxseq = [0] * int(config['GENERAL']['NUM_CAMERAS'])
+        self.processed = [0] * int(config['GENERAL']['NUM_CAMERAS'])
+        self.latencies = [deque(maxlen=1000) for _ in range(int(config['GENERAL']['NUM_CAMERAS']))]
+        self.nextstats = time() + STATS_INTERVAL
+        # per camera plate trackers, every track is decided once from the votes of its readings
+        self.trackers = [tracker.PlateTracker.fromcfg(config['GENERAL']) for _ in camcfgs]
+        # the workers share one set of trackers to decide which crops to recognize, a track is read at most 'track_budget' times by all workers together
+        self.readgate = self.mpmanager.ReadGate(dict(config['GENERAL']), len(camcfgs)) if any(t is not None for t in self.trackers) else None
+        # camera configs for the detection regions of the workers
+        self.camcfgs = [dict(cfg) for cfg in camcfgs]
 
         if outputQueue is None:
-            if inputQueue is None:
-                self.outQ = self.inQ
-            else:
-                self.outQ = self.mpmanager.Namespace()
+            self.outQ = mp.Queue()
         else:
             self.outQ = outputQueue
 
-        for i in range(int(config['GENERAL']['NUM_WORKERS'])):
-            self.outQ.__setattr__(f"wkr_id{i}", None)
-
         self.nextautopass = mp.Queue()
         self.dbmgr = dbmgr.DatabaseHandler(f"{SELFDIR}/lp.csv", logger=self.logger, overridedb=self.mpmanager.dict())
         self.successCallback = successCallback
 
         self.guiQueue = mp.Queue()
-        self.gui = mp.Process(target=gui.GUImgr, args=(self.guiQueue, self.dbmgr, self.nextautopass))
+        self.gui = mp.Process(target=gui.GUImgr, args=(self.guiQueue, self.dbmgr, self.nextautopass), kwargs={"framebuffer_prefix":self.framebuffer_prefix})
         self.gui.start()
 
         self.logger.addHandler(QueueHandler(self.guiQueue))
@@ -82,39 +108,84 @@ class taskDistributor:
         self.loggerQueueListener.start()
 
         # determine which model type to use
-        if config['GENERAL']['MODEL_TYPE'] in ['lite', 'tf']:
-            model_type = config['GENERAL']['MODEL_TYPE']
+        model_type = config['GENERAL']['MODEL_TYPE']
+        if model_type.partition('-')[0] not in detectors.available():
+            raise ValueError(f"Model type {model_type} is unknown or its runtime is not installed, backends with a model in saved_model: {', '.join(detectors.available(f'{SELFDIR}/saved_model')) or 'none'}")
+
+        # the worker pool is scaled between min_workers and max_workers, keeping up to spare_workers parked with their models loaded
+        num_workers = max(1, int(config['GENERAL']['NUM_WORKERS']))
+        self.min_workers = max(1, int(config['GENERAL'].get('MIN_WORKERS', num_workers)))
+        self.max_workers = max(self.min_workers, int(config['GENERAL'].get('MAX_WORKERS', num_workers)))
+        if not self.min_workers <= num_workers <= self.max_workers:
+            # the number of workers to start with wins over the scaling range
+            self.logger.warning(f"num_workers = {num_workers} is outside of min_workers = {self.min_workers} to max_workers = {self.max_workers}, scaling between {min(self.min_workers, num_workers)} and {max(self.max_workers, num_workers)} instead")
+            self.min_workers, self.max_workers = min(self.min_workers, num_workers), max(self.max_workers, num_workers)
+        self.spare_workers = int(config['GENERAL'].get('SPARE_WORKERS', 1))
+        self.scale_interval = float(config['GENERAL'].get('SCALE_INTERVAL', SCALE_INTERVAL))
+        self.model_type = model_type
+        # workers claim micro-batches of up to batch_size frames, waiting at most batch_wait seconds for the batch to fill
+        self.batch_size = int(config['GENERAL'].get('BATCH_SIZE', 1))
+        self.batch_wait = float(config['GENERAL'].get('BATCH_WAIT', 0))
+        # interpreter threads (0 lets TensorFlow Lite decide) and delegate of the lite model, tuned with 'benchmark.py tune'
+        self.num_threads = int(config['GENERAL'].get('LITE_THREADS', 0)) or None
+        # OCR model settings, the model itself is only loaded in the worker processes
+        self.ocrconfig = worker.OcrConfig.fromcfg(config['GENERAL'])
+        # OCR cache entries shared by all workers, if enabled
+        self.sharedcache = self.mpmanager.dict() if config['GENERAL'].getboolean('OCR_CACHE_SHARED', False) else None
+        self.delegate = config['GENERAL'].get('LITE_DELEGATE', 'xnnpack')
+        self.nextworkerid = 0
+        # worker busy periods since the last scaling decision, dispatch time to finish time of every batch
+        self.busy = {}
+        self.backlog = []
+        self.expired = 0
+        self.lastscale = time()
+        self.task_deadline = float(config['GENERAL'].get('TASK_DEADLINE', TASK_DEADLINE))
+        self.startupfailures = 0
 
         # start the worker and camera processes
-        self.workers = [workerHandler(i, output=self.outQ, loggerQueue=self.loggerQueue, model_type=model_type) for i in range(int(config['GENERAL']['NUM_WORKERS']))]
-        self.cameras = [CameraHandler(i, self.inQ, loggerQueue=self.loggerQueue) for i in range(int(config['GENERAL']['NUM_CAMERAS']))]
-
-        self.logger.info(f"Created {len(self.workers)} worker(s) with {len(self.cameras)} camera(s) as inputs")
+        self.workers = []
+        # retired workers finishing their last frame, kept referenced as dropping a handler kills its process
+        self.retiring = []
+        for _ in range(num_workers):
+            self.addworker(active=True)
+        self.addspares()
+        # all cameras are served by a few capture processes, one thread per camera
+        num_cameras = int(config['GENERAL']['NUM_CAMERAS'])
+        num_capture = max(1, min(num_cameras, int(config['GENERAL'].get('CAPTURE_PROCESSES', 1))))
+        self.cameras = [CameraHandler(ids := list(range(i, num_cameras, num_capture)), [self.inQ.names[j] for j in ids], loggerQueue=self.loggerQueue, ready=self.inQ) for i in range(num_capture)]
+
+        self.logger.info(f"Created {len(self.workers)} worker(s) ({self.min_workers} to {self.max_workers} active) with {num_cameras} camera(s) in {len(self.cameras)} capture process(es) as inputs")
         self.logger.info("Starting main loop")
 
-    def distribute(self):
-        """Will check for new tasks and assign them to workers. Needs to be called in a loop.
+    def poll(self, timeout=0.5):
+        """Wait for the next worker result and check it. Needs to be called in a loop.
+
+        Args:
+            timeout (float, optional): Seconds to block waiting for a result. Defaults to 0.5.
         """
         if self.gui.exitcode is not None:
             self.logger.info("GUI closed, exiting")
             self.kill()
             exit(0)
-        frame = getattr(self.inQ, f"cam_id{self.inQ_nextidx}")
-        if frame == []:
-            sleep(0.01)
+        if time() > self.nextstats:
+            self.logstats()
+            self.nextstats = time() + STATS_INTERVAL
+        self.supervise()
+        self.expiretracks()
+        self.backlog.append(self.inQ.backlog())
+        if time() > self.lastscale + self.scale_interval:
+            self.scale()
+        try:
+            task = self.outQ.get(timeout=timeout)
+        except queue.Empty:
             return
-        for worker in self.workers:
-            worker.update()
-            if not worker.busy:
-                worker.assignTask(frame)
-                self.inQ.__setattr__(f"cam_id{self.inQ_nextidx}", [])
-                self.inQ_nextidx = (self.inQ_nextidx + 1) % int(config['GENERAL']['NUM_CAMERAS'])
+        self.check(task)
 
     def check(self, task:utils.Task):
         """Will check if the task is valid and should be processed
 
         Args:
-            task (utils.Task): Task to check in format (bbox, (lp, conf))
+            task (utils.Task): Task to check, its data holds the readings [bbox, (lp, conf)] of every detected plate
 
         Returns:
             Bool: Success
@@ -126,37 +197,202 @@ class taskDistributor:
         except:
             nextpass = 0
         if time() < nextpass:
-            self.logger.info(f"Manual override trigerred")
+            self.logger.info("Manual override trigerred")
             success = True
         else:
-            # check if the task is valid
-            if len(task.data) == 0: return
-
-            if len(task.data) >= 2:
-                joinedtask = utils.joinpredictions(task)
-            else:
-                joinedtask = utils.Task(task.id, task.data[0])
-            if len(joinedtask.data[1]) != 2: return
-            # unpack the task data
-            bbox, (lp, conf) = joinedtask.data
-            # check if the LP is in the database
-            self.logger.info(f"Checking LP: {lp}")
-            if (valid := next((entry for entry in self.dbmgr if entry[0] in lp), None)) != None:
-            # if any([dbentry[0] in lp for dbentry in self.dbmgr]):
-            # if lp in self.dbmgr:
-            # if True:
-                success = True
+            tracks = self.track(task)
+            # one reading per detected plate, plates skipped by the tracking budget have none
+            for j, readings in enumerate(task.data):
+                if len(readings) == 0: continue
+                if len(readings) >= 2:
+                    joinedtask = utils.joinpredictions(task.reply(readings))
+                else:
+                    joinedtask = task.reply(readings[0])
+                if len(joinedtask.data[1]) != 2: continue
+                # unpack the reading
+                bbox, (lp, conf) = joinedtask.data
+                if tracks is not None:
+                    # a tracked plate is checked once, with the reading agreed on by enough of its frames.
+                    # A cached reading repeats an earlier recognition, it only counts for a track without readings
+                    if not (task.cached and task.cached[j]) or not tracks[j].votes:
+                        self.trackers[task.id].vote(tracks[j], lp, conf)
+                    if (decision := self.trackers[task.id].decide(tracks[j])) is None: continue
+                    lp, conf = decision
+                # check if the LP is in the database
+                success = self.lookup(lp) or success
+            self.record(task)
 
         if success:
-            self.logger.info(f"Found valid LP: {valid[0]}; {valid[1]}")
             # send callback
             self.successCallback()
 
+    def lookup(self, lp:str):
+        """Check if a licence plate is in the database
+
+        Args:
+            lp (str): Recognized licence plate.
+
+        Returns:
+            Bool: Found
+        """
+        self.logger.info(f"Checking LP: {lp}")
+        if (valid := next((entry for entry in self.dbmgr if entry[0] in lp), None)) is None:
+            return False
+        self.logger.info(f"Found valid LP: {valid[0]}; {valid[1]}")
+        return True
+
+    def track(self, task:utils.Task):
+        """Assign the plates of a task to their tracks
+
+        Args:
+            task (utils.Task): Finished task.
+
+        Returns:
+            list: Track of every plate, None if the camera is not tracked or no plate was detected
+        """
+        if not task.boxes or not 0 <= task.id < len(self.trackers) or self.trackers[task.id] is None:
+            return None
+        return self.trackers[task.id].update(task.boxes, task.captured or None)
+
+    def expiretracks(self):
+        """End the tracks of plates which left the view, checking the leading reading of tracks which were not decided yet
+        """
+        for camid, camtracker in enumerate(self.trackers):
+            if camtracker is None:
+                continue
+            # results arrive a latency after the capture, which must not end the tracks early
+            now = time() - (np.median(self.latencies[camid]) / 1000 if self.latencies[camid] else 0)
+            for track, decision in camtracker.expire(now):
+                if decision is not None and self.lookup(decision[0]):
+                    self.successCallback()
+
+    def record(self, task:utils.Task):
+        """Mark the task as decided and record its capture to decision latency
+
+        Args:
+            task (utils.Task): Finished task.
+        """
+        task.stamp('decided')
+        timings = task.timings()
+        if task.captured and 0 <= task.id < len(self.latencies):
+            self.latencies[task.id].append(timings['total'])
+            self.maxseq[task.id] = max(self.maxseq[task.id], task.seq)
+            self.processed[task.id] += 1
+        if task.dispatched:
+            # the worker is busy with a batch until its last frame is finished
+            end = max(task.dispatched, task.dequeued, task.detected, task.recognized)
+            self.busy[task.dispatched] = max(self.busy.get(task.dispatched, end), end)
+        self.logger.debug(f"Camera {task.id} frame {task.seq}: " + ", ".join(f"{k} {v:.1f} ms" for k, v in timings.items()))
+
+    def logstats(self):
+        """Log the per camera capture to decision latency and the number of skipped frames
+        """
+        for camid, latencies in enumerate(self.latencies):
+            if len(latencies) == 0:
+                continue
+            p50, p95 = np.percentile(latencies, [50, 95])
+            # published frames which were overwritten before a worker took them or dropped for missing the deadline
+            buffer = self.framebuffers.get(self.inQ.names[camid])
+            expired = buffer.expired if buffer is not None else 0
+            skipped = self.maxseq[camid] - self.processed[camid] - expired
+            self.logger.info(f"Camera {camid}: latency p50 {p50:.0f} ms, p95 {p95:.0f} ms, {skipped} frame(s) skipped, {expired} frame(s) past deadline")
+
+    def addworker(self, active:bool):
+        """Start a new worker process
+
+        Args:
+            active (bool): Start taking frames once the models are loaded, otherwise the worker is parked as a spare.
+
+        Returns:
+            workerHandler: The new worker
+        """
+        handler = workerHandler(self.nextworkerid, self.inQ, output=self.outQ, loggerQueue=self.loggerQueue, model_type=self.model_type, active=active, batch_size=self.batch_size, batch_wait=self.batch_wait, gate=self.readgate, num_threads=self.num_threads, delegate=self.delegate, cameras=self.camcfgs, ocr_config=self.ocrconfig, ocr_cache=dict(config['GENERAL']), shared_cache=self.sharedcache)
+        self.nextworkerid += 1
+        self.workers.append(handler)
+        return handler
+
+    def addspares(self):
+        """Start parked workers until there are 'spare_workers' of them
+        """
+        if self.startupfailures >= MAX_STARTUP_FAILURES:
+            return
+        while sum(not w.active for w in self.workers) < self.spare_workers:
+            self.addworker(active=False)
+
+    def supervise(self):
+        """Replace dead workers and kill hung ones, a parked spare takes over right away and a new spare is started in the background.
+        A worker is hung when it spends more than 'task_deadline' seconds on a batch or sends no heartbeat for HEARTBEAT_TIMEOUT seconds while idle.
+        The frames a replaced worker was processing are dropped, they are outdated by the time it is noticed.
+        """
+        for handler in list(self.workers):
+            if not handler.alive:
+                reason = f"exited with code {handler.exitcode}"
+            elif not handler.ready:
+                # still loading its models
+                continue
+            elif handler.busy > self.task_deadline:
+                reason = f"was processing a batch for {handler.busy:.0f} s"
+            elif not handler.busy and handler.heartbeat > HEARTBEAT_TIMEOUT:
+                reason = f"sent no heartbeat for {handler.heartbeat:.0f} s"
+            else:
+                continue
+            handler.kill()
+            self.workers.remove(handler)
+            self.logger.error(f"Worker {handler.id} {reason}, replacing it")
+            self.startupfailures = 0 if handler.ready else self.startupfailures + 1
+            if self.startupfailures >= MAX_STARTUP_FAILURES:
+                self.logger.error(f"{self.startupfailures} workers failed to start in a row, not replacing workers anymore")
+            elif handler.active:
+                # prefer a spare which already loaded its models
+                if spares := [w for w in self.workers if not w.active]:
+                    max(spares, key=lambda w: w.ready).activate()
+                else:
+                    self.addworker(active=True)
+        self.addspares()
+
+    def scale(self):
+        """Grow or shrink the active worker pool by one worker based on the utilisation, backlog and deadline misses since the last call
+        """
+        now = time()
+        active = [w for w in self.workers if w.active]
+        spares = [w for w in self.workers if not w.active]
+        if not active:
+            # all workers failed to start, see MAX_STARTUP_FAILURES
+            self.busy, self.backlog, self.lastscale = {}, [], now
+            return
+        utilisation = sum(end - start for start, end in self.busy.items()) / (len(active) * (now - self.lastscale))
+        backlog = np.mean(self.backlog) if self.backlog else 0
+        expired = sum(buffer.expired for name in self.inQ.names if (buffer := self.framebuffers.get(name)) is not None)
+        missed = expired - self.expired
+        self.busy, self.backlog, self.expired, self.lastscale = {}, [], expired, now
+
+        # the load time of starting workers would skew the utilisation
+        if not all(w.ready for w in active):
+            return
+        if (missed > 0 or backlog >= 1 or utilisation > SCALE_UP_UTILISATION) and len(active) < self.max_workers:
+            # prefer a spare which already loaded its models
+            if spares:
+                max(spares, key=lambda w: w.ready).activate()
+            else:
+                self.addworker(active=True)
+            self.logger.info(f"Scaling up to {len(active) + 1} worker(s): utilisation {utilisation:.0%}, backlog {backlog:.1f}, {missed} deadline miss(es)")
+        elif missed == 0 and backlog < 1 and len(active) > self.min_workers and utilisation * len(active) / (len(active) - 1) < SCALE_DOWN_UTILISATION:
+            active[-1].deactivate()
+            spares.append(active[-1])
+            self.logger.info(f"Scaling down to {len(active) - 1} worker(s): utilisation {utilisation:.0%}")
+            # spares beyond 'spare_workers' are retired to free their memory
+            for handler in spares[:max(0, len(spares) - self.spare_workers)]:
+                handler.retire()
+                self.workers.remove(handler)
+                self.retiring.append(handler)
+        self.retiring = [w for w in self.retiring if w.alive]
+        self.addspares()
+
     def kill(self):
         self.gui.kill()
-        for worker in self.workers:
+        for handler in self.workers + self.retiring:
             try:
-                worker.kill()
+                handler.kill()
             except:
                 pass
         for cam in self.cameras:
@@ -164,24 +400,32 @@ class taskDistributor:
                 cam.kill()
             except:
                 pass
+        # the killed camera processes can not clean up their frame buffers
+        for name in self.inQ.names:
+            if (buffer := self.framebuffers.get(name)) is not None:
+                buffer.unlink()
+        self.framebuffers.close()
 
 class CameraHandler:
-    """Wrapper class for the camera process for easier management
+    """Wrapper class for a capture process serving one or more cameras for easier management
     """
-    def __init__(self, id:int, inputQ, loggerQueue=mp.Queue()):
-        """Initialize the camera handler and start the camera process
+    def __init__(self, ids:list, inputQ:list, loggerQueue=mp.Queue(), ready:framebuffer.ReadySet=None):
+        """Initialize the camera handler and start the capture process
 
         Args:
-            id (int): Camera process ID. Defaults to -1.
-            inputQ (Namespace, optional): Collected frames will be put here in the utils.task form.
+            ids (list): IDs of the cameras served by the process.
+            inputQ (list): Shared memory names of the frame buffers the cameras will publish their frames to.
             loggerQueue (mp.Queue, optional): Queue for logging connections. Defaults to mp.Queue().
+            ready (framebuffer.ReadySet, optional): Ready set the cameras notify of new frames. Defaults to None.
         """
-        # start the camera process
-        cfg = {"protocol":"rtsp", "port":554, "login":"admin", "password":"admin", "ip":"127.0.0.1", "id":id}
-        cfg |= {k:v for k,v in config[f'CAM_{id}'].items()}
-        self._process = mp.Process(target=camera.Camera, args=(cfg, inputQ, loggerQueue, True), name=f"Camera_{id}_process")
+        # start the capture process
+        self.cfgs = []
+        for id in ids:
+            cfg = {"protocol":"rtsp", "port":554, "login":"admin", "password":"admin", "ip":"127.0.0.1", "id":id}
+            cfg |= {k:v for k,v in config[f'CAM_{id}'].items()}
+            self.cfgs.append(cfg)
+        self._process = mp.Process(target=camera.capture, args=(self.cfgs, inputQ, loggerQueue, ready), name=f"Capture_{'_'.join(map(str, ids))}_process")
         self._process.start()
-        self.cfg = cfg
 
     def kill(self):
         self._process.kill()
@@ -189,48 +433,89 @@ class CameraHandler:
 class workerHandler:
     """Wrapper class for the worker process for easier management
     """
-    def __init__(self, id:int, output, callback=lambda *_:None, loggerQueue=mp.Queue(), model_type='tf'):
+    def __init__(self, id:int, inputQ:framebuffer.ReadySet, output:mp.Queue, loggerQueue=mp.Queue(), model_type='tf', active=True, batch_size=1, batch_wait=0.0, gate=None, num_threads:int=None, delegate:str='xnnpack', cameras:list=None, ocr_config:worker.OcrConfig=None, ocr_cache:dict=None, shared_cache=None):
         """Initialize the worker handler and start the worker process
 
         Args:
             id (int, optional): Worker ID. Defaults to -1.
-            output (Namespace): Namespace for outputting finished tasks.
-            callback (function, optional): Callback on successful return from task. Defaults to lambda*_:None.
+            inputQ (framebuffer.ReadySet): Ready set the worker pulls frames from.
+            output (mp.Queue): Result queue shared by all the workers.
             loggerQueue (mp.Queue, optional): Queue for logging connections. Defaults to mp.Queue().
             model_type (str, optional): Model type to use. Defaults to 'tf'.
+            active (bool, optional): Take frames once the models are loaded, otherwise the worker is parked as a spare. Defaults to True.
+            batch_size (int, optional): Maximum number of frames the worker claims and detects together. Defaults to 1.
+            batch_wait (float, optional): Seconds the worker waits for a batch to fill after its first frame. Defaults to 0.
+            gate (tracker.ReadGate, optional): Proxy of the read gate shared by the workers. Every crop is recognized if None. Defaults to None.
+            num_threads (int, optional): Interpreter threads of the lite model, TensorFlow Lite decides if None. Defaults to None.
+            delegate (str, optional): Delegate of the lite model, see detectors.LiteDetector. Defaults to 'xnnpack'.
+            cameras (list, optional): Camera configs as dictionaries by camera id, for the detection regions of the worker. Defaults to None.
+            ocr_config (worker.OcrConfig, optional): OCR model settings of the worker. Defaults to None.
+            ocr_cache (dict, optional): OCR cache config of the worker, see ocrcache.OcrCache.fromcfg. Defaults to None.
+            shared_cache (dict, optional): OCR cache entries shared by the workers. Defaults to None.
         """
         self.logger = logging.getLogger(__name__)
-        # setup communication queues
-        self._Qsend, self._Qrecv = mp.Queue(), mp.Queue()
+        self._active = mp.Event()
+        self._ready = mp.Event()
+        self._retire = mp.Event()
+        self._heartbeat = mp.Value('d', 0.0, lock=False)
+        self._busy = mp.Value('d', 0.0, lock=False)
+        if active:
+            self._active.set()
         # start the worker process
-        self._process = mp.Process(target=worker.Worker, args=(self._Qsend, self._Qrecv, loggerQueue), kwargs={"autostart":True, "model_type":model_type}, name=f"Worker_{id}_process")
+        self._process = mp.Process(target=worker.Worker, args=(inputQ, output, loggerQueue), kwargs={"autostart":True, "model_type":model_type, "active":self._active, "ready":self._ready, "retire":self._retire, "batch_size":batch_size, "batch_wait":batch_wait, "heartbeat":self._heartbeat, "busy":self._busy, "gate":gate, "num_threads":num_threads, "delegate":delegate, "cameras":cameras, "ocr_config":ocr_config, "ocr_cache":ocr_cache, "shared_cache":shared_cache}, name=f"Worker_{id}_process")
         self._process.start()
         self._id = id
-        self.busy = False
-        self.callback = callback
-        self.output = output
 
-    def assignTask(self, task:utils.Task):
-        """Assign a task to the worker process
+    @property
+    def active(self):
+        """Whether the worker takes frames"""
+        return self._active.is_set()
+
+    @property
+    def ready(self):
+        """Whether the worker loaded its models"""
+        return self._ready.is_set()
+
+    @property
+    def alive(self):
+        """Whether the worker process is still running"""
+        return self._process.is_alive()
+
+    @property
+    def exitcode(self):
+        """Exit code of the worker process, None while running"""
+        return self._process.exitcode
+
+    @property
+    def id(self):
+        """Worker ID"""
+        return self._id
+
+    @property
+    def heartbeat(self):
+        """Seconds since the last heartbeat of the worker"""
+        return time() - self._heartbeat.value
+
+    @property
+    def busy(self):
+        """Seconds the worker has been processing its current batch, 0 while idle"""
+        return time() - self._busy.value if self._busy.value else 0.0
+
+    def activate(self):
+        """Let a parked worker take frames
+        """
+        self._active.set()
 
-        Args:
-            task (utils.Task): Task to assign to the worker.
+    def deactivate(self):
+        """Park the worker after its current frame, keeping its models loaded
         """
-        # assign a task to the worker process and mark it as busy
-        self.logger.debug(f"Assigning task {task} to worker {self._id}")
-        self.busy = True
-        self._Qsend.put(task, block=False)
+        self._active.clear()
 
-    def update(self):
-        """Check if the worker has finished a task and put it in the output queue
+    def retire(self):
+        """Let the worker process exit after its current frame
         """
-        # check if the worker has finished a task, if so, mark it as not busy and put the task in the output queue
-        if self._Qrecv.qsize() == 0: return
-        self.busy = False
-        taskdone = self._Qrecv.get()
-        self.output.__setattr__(f"wkr_id{self._id}", taskdone)
-        self.logger.debug(f"Worker {self._id} finished task {taskdone.id}")
-        self.callback()
+        self._active.clear()
+        self._retire.set()
 
     def kill(self):
         """Kill the worker process
@@ -242,21 +527,16 @@ class workerHandler:
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="License plate recognition system")
+    parser.add_argument('--config', default=f"{SELFDIR}/config.ini", help="Path to the config file. Defaults to config.ini next to this file.")
+    args = parser.parse_args()
     config = ConfigParser()
-    config.read(f"{SELFDIR}/config.ini")
+    config.read(args.config)
     t = taskDistributor(logger)
     logger.info("Main process startup complete.")
-    nextcheck = 0
     try:
         while True:
-            f = t.outQ.__getattr__(f"wkr_id{nextcheck}")
-            t.outQ.__setattr__(f"wkr_id{nextcheck}", None)
-            if not f is None:
-                t.check(f)
-            else:
-                sleep(0.05)
-            nextcheck = (nextcheck + 1) % int(config['GENERAL']['NUM_WORKERS'])
-            t.distribute()
+            t.poll()
     except KeyboardInterrupt:
         logger.info("Main process shutdown.")
         exit()
@@ -0,0 +1,149 @@
+from collections import OrderedDict
+from time import time
+import numpy as np
+import cv2
+
+
+def phash(img:np.ndarray, size:int=8):
+    """Perceptual hash of a plate crop, robust to small shifts, scaling, noise and brightness changes
+
+    Args:
+        img (np.ndarray): Plate crop.
+        size (int, optional): Side of the kept low frequency DCT block, the hash has size * size bits. Defaults to 8.
+
+    Returns:
+        int: The hash
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    # normalise the crop to a fixed size and contrast before comparing frequencies
+    small = cv2.resize(gray, (size * 4, size * 4), interpolation=cv2.INTER_AREA).astype(np.float32)
+    small = cv2.normalize(small, None, 0, 1, cv2.NORM_MINMAX)
+    block = cv2.dct(small)[:size, :size].flatten()
+    # the DC term only holds the mean brightness
+    bits = block > np.median(block[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+class OcrCache:
+    """LRU cache of OCR results keyed by the camera id and the perceptual hash of the plate crop.
+    Near-duplicate crops of a car waiting at the barrier get the cached reading instead of being recognized again.
+    Entries expire 'ttl' seconds after they were recognized, so a waiting car is still read again from time to time.
+    """
+    def __init__(self, maxsize:int=256, ttl:float=5.0, max_distance:int=8, shared=None):
+        """Initialize the cache
+
+        Args:
+            maxsize (int, optional): Maximum number of entries, the least recently used are evicted first. Defaults to 256.
+            ttl (float, optional): Seconds an entry is valid after it was recognized. Defaults to 5.0.
+            max_distance (int, optional): Maximum Hamming distance between the hashes of near-duplicate crops, a few pixels of box jitter give up to about 8 of the 64 bits. Defaults to 8.
+            shared (dict, optional): Dictionary shared by the workers (e.g. multiprocessing.Manager().dict()) holding the recent (hash, time, result) entries of every camera id, oldest first. Misses are looked up in and results are published to it. Defaults to None.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.shared = shared
+        # (camera id, hash) to (recognition time, result)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def fromcfg(cls, cfg:dict, shared=None):
+        """Create a cache from the GENERAL config section
+
+        Args:
+            cfg (dict): GENERAL config section as a dictionary with the optional 'ocr_cache', 'ocr_cache_ttl' and 'ocr_cache_distance' keys.
+            shared (dict, optional): Dictionary shared by the workers. Defaults to None.
+
+        Returns:
+            OcrCache: The cache, None if caching is disabled with 'ocr_cache = 0'
+        """
+        maxsize = int(cfg.get('ocr_cache', 256))
+        if maxsize <= 0:
+            return None
+        return cls(maxsize=maxsize, ttl=float(cfg.get('ocr_cache_ttl', 5.0)), max_distance=int(cfg.get('ocr_cache_distance', 8)), shared=shared)
+
+    def _find(self, entries, camid:int, key:int, now:float):
+        """Find the fresh entry of a camera closest to a hash
+
+        Args:
+            entries (Iterable): (key, (time, result)) pairs.
+            camid (int): Camera id.
+            key (int): Hash of the crop.
+            now (float): Current time.
+
+        Returns:
+            tuple: ((camera id, hash), (time, result)) of the entry, None if there is no near-duplicate
+        """
+        best, bestdistance = None, self.max_distance + 1
+        for entry in entries:
+            (cam, other), (stamp, _) = entry
+            if cam != camid or now - stamp > self.ttl:
+                continue
+            if (distance := bin(key ^ other).count('1')) < bestdistance:
+                best, bestdistance = entry, distance
+        return best
+
+    def get(self, camid:int, key:int, now:float=None):
+        """Get the cached result of a crop
+
+        Args:
+            camid (int): Camera id.
+            key (int): Hash of the crop, see phash.
+            now (float, optional): Current time. Defaults to the current time.
+
+        Returns:
+            list: The cached OCR result, None on a miss
+        """
+        now = time() if now is None else now
+        self.expire(now)
+        if (entry := self._find(self.entries.items(), camid, key, now)) is None and self.shared is not None:
+            # only the recent entries of the camera are transferred from the shared dictionary
+            recent = (((camid, other), (stamp, result)) for other, stamp, result in self.shared.get(camid, ()))
+            if (entry := self._find(recent, camid, key, now)) is not None:
+                self.entries[entry[0]] = entry[1]
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(entry[0])
+        self.hits += 1
+        return entry[1][1]
+
+    def put(self, camid:int, key:int, result:list, now:float=None):
+        """Cache the OCR result of a crop
+
+        Args:
+            camid (int): Camera id.
+            key (int): Hash of the crop, see phash.
+            result (list): OCR result.
+            now (float, optional): Recognition time. Defaults to the current time.
+        """
+        now = time() if now is None else now
+        self.entries[(camid, key)] = (now, result)
+        self.entries.move_to_end((camid, key))
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        if self.shared is not None:
+            # the shared entries of a camera are kept oldest first and trimmed by age and count on every put,
+            # a concurrent put of another worker may be overwritten, which only costs one recognition
+            recent = [entry for entry in self.shared.get(camid, ()) if now - entry[1] <= self.ttl and entry[0] != key]
+            self.shared[camid] = tuple(recent[max(0, len(recent) - self.maxsize + 1):]) + ((key, now, result),)
+
+    def expire(self, now:float=None):
+        """Remove the entries older than 'ttl'
+
+        Args:
+            now (float, optional): Current time. Defaults to the current time.
+        """
+        now = time() if now is None else now
+        for key in [key for key, (stamp, _) in self.entries.items() if now - stamp > self.ttl]:
+            del self.entries[key]
+
+    def stats(self):
+        """Get the hit and miss counters
+
+        Returns:
+            dict: 'hits', 'misses', 'hitrate' and 'size' of the cache
+        """
+        total = self.hits + self.misses
+        return {'hits':self.hits, 'misses':self.misses, 'hitrate':self.hits / total if total else 0.0, 'size':len(self.entries)}
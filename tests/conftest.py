@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules are imported from the repository root like the scripts do
+sys.path.insert(0, os.path.abspath(f'{__file__}/../..'))
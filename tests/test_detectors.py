@@ -0,0 +1,45 @@
+import numpy as np
+
+import detectors
+
+
+class RecordingDetector(detectors.BaseDetector):
+    """Detector keeping a copy of the inputs of every batch, finding one box in the top left quarter of each input"""
+    @classmethod
+    def modelpath(cls, directory:str, variant:str=''):
+        return directory
+
+    def __call__(self, img):
+        return self.batch([img])[0]
+
+    def batch(self, imgs:list):
+        self.inputs = [np.array(img) for img in imgs]
+        return [{'detection_scores':np.array([[0.9]], dtype=np.float32), 'detection_boxes':np.array([[[0.0, 0.0, 0.25, 0.25]]], dtype=np.float32)} for _ in imgs]
+
+
+def test_letterboxed_batch_of_one_camera():
+    detector = RecordingDetector()
+    region = detectors.RegionDetector(detector, letterbox=True)
+    first, second = np.full((360, 640, 3), 50, dtype=np.uint8), np.full((360, 640, 3), 200, dtype=np.uint8)
+    results = detectors.detectregions(detector, [region, region], [first, second])
+    assert len(detector.inputs) == 2
+    # the regions are letterboxed into the top of the square inputs
+    assert (detector.inputs[0][:360] == 50).all() and (detector.inputs[1][:360] == 200).all()
+    assert (detector.inputs[0][360:] == 0).all() and (detector.inputs[1][360:] == 0).all()
+    for result in results:
+        np.testing.assert_allclose(result['detection_boxes'][0][0], [0.0, 0.0, 640 / 360 * 0.25, 0.25], rtol=1e-5)
+
+
+def test_stretched_batch_of_one_camera():
+    detector = RecordingDetector()
+    region = detectors.RegionDetector(detector)
+    first, second = np.full((360, 640, 3), 50, dtype=np.uint8), np.full((360, 640, 3), 200, dtype=np.uint8)
+    region.batch([first, second])
+    assert (detector.inputs[0] == 50).all() and (detector.inputs[1] == 200).all()
+
+
+def test_warmup_without_shapes():
+    detector = RecordingDetector()
+    # the camera resolution is unknown without letterboxing, a backend resizing to its model input still runs once
+    detector.warmup(detectors.RegionDetector(detector).inputshapes())
+    assert [img.shape for img in detector.inputs] == [(detectors.INPUT_SIZE, detectors.INPUT_SIZE, 3)]
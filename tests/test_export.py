@@ -0,0 +1,25 @@
+import os
+
+import numpy as np
+
+import export
+
+SELFDIR = os.path.abspath(f'{__file__}/../..')
+
+
+def test_plate_split_holds_out_the_same_plates():
+    plates = export.loadplates(f"{SELFDIR}/LP_Detection/trainlps", f"{SELFDIR}/LP_Detection/trainlabels")
+    train, evaluation = export.splitplates(plates)
+    assert train and evaluation and len(train) + len(evaluation) == len(plates)
+    assert not {label for _, label in train} & {label for _, label in evaluation}
+    # the set of a plate does not depend on the other plates
+    subset = plates[::-1][:20]
+    held = {label for _, label in evaluation}
+    assert [label for _, label in export.splitplates(subset)[1]] == [label for _, label in subset if label in held]
+
+
+def test_plate_split_of_unseen_labels():
+    crop = np.zeros((20, 60, 3), dtype=np.uint8)
+    labels = [f"AB{i:04d}" for i in range(1000)]
+    _, evaluation = export.splitplates([(crop, label) for label in labels])
+    assert 0.2 < len(evaluation) / len(labels) < 0.3
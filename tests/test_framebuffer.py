@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+
+import pytest
+
+import framebuffer
+
+
+@pytest.fixture(autouse=True)
+def tracked(monkeypatch):
+    # the buffers are created and attached in the same process here, the owner's unlink unregisters them from the resource tracker
+    monkeypatch.setattr(framebuffer.resource_tracker, 'unregister', lambda *args: None)
+
+
+def test_reader_reattaches_after_resize():
+    name = framebuffer.buffer_name(f"lprtest{os.getpid()}", 0)
+    buffer = framebuffer.FrameRingBuffer.create(name, (4, 4, 3), slots=2)
+    reader = framebuffer.BufferReader()
+    try:
+        buffer.write(np.full((4, 4, 3), 1, dtype=np.uint8))
+        assert reader.read(reader.get(name).latest())[0].shape == (4, 4, 3)
+        # a reconnect at a larger resolution replaces the buffer
+        buffer.close()
+        buffer = framebuffer.FrameRingBuffer.create(name, (8, 8, 3), slots=2)
+        ref = buffer.write(np.full((8, 8, 3), 2, dtype=np.uint8))
+        attached = reader.get(name)
+        assert attached.capacity == 8 * 8 * 3
+        assert attached.pending
+        frame, _ = reader.read(ref)
+        assert frame.shape == (8, 8, 3) and (frame == 2).all()
+    finally:
+        reader.close()
+        buffer.close()
+
+
+def test_claim_after_resize():
+    name = framebuffer.buffer_name(f"lprtest{os.getpid()}", 1)
+    buffer = framebuffer.FrameRingBuffer.create(name, (4, 4, 3), slots=2)
+    ready = framebuffer.ReadySet([name])
+    try:
+        buffer.write(np.zeros((4, 4, 3), dtype=np.uint8))
+        assert ready.claim(timeout=0.1) is not None
+        buffer.close()
+        buffer = framebuffer.FrameRingBuffer.create(name, (8, 8, 3), slots=2)
+        ref = buffer.write(np.zeros((8, 8, 3), dtype=np.uint8))
+        assert ready.claim(timeout=0.1) == (0, ref)
+    finally:
+        ready._reader.close()
+        buffer.close()
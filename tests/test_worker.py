@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+import pytest
+
+# the worker imports the GUI helpers of utils
+pytest.importorskip('PyQt5')
+import export
+import worker
+
+SELFDIR = os.path.abspath(f'{__file__}/../..')
+
+
+class RecordingOcr:
+    """PaddleOCR stand-in recording which crops go to the text detector and which lines to the recognizer alone"""
+    def __init__(self):
+        self.detected = []
+        self.recognized = []
+
+    def ocr(self, img, cls=False):
+        self.detected.append(img.shape)
+        height, width = img.shape[:2]
+        return [[[[[0, 0], [width, 0], [width, height], [0, height]], ('DET', 0.9)]]]
+
+    def text_recognizer(self, imgs):
+        self.recognized += [img.shape for img in imgs]
+        return [('REC', 0.9) for _ in imgs], 0.0
+
+
+def plate(label:str):
+    plates = export.loadplates(f"{SELFDIR}/LP_Detection/trainlps", f"{SELFDIR}/LP_Detection/trainlabels")
+    return next(crop for crop, text in plates if text == label)
+
+
+def test_near_square_single_line_uses_text_detector():
+    crop = plate('ABF606')
+    height, width = crop.shape[:2]
+    assert width < worker.SINGLE_LINE_ASPECT * height and len(worker.splitlines(crop)) == 1
+    ocr = RecordingOcr()
+    assert worker.get_text(crop, ocr)[0][1][0] == 'DET'
+    assert ocr.detected == [crop.shape] and ocr.recognized == []
+
+
+def test_wide_and_two_row_plates_skip_text_detector():
+    wide = np.full((40, 200, 3), 255, dtype=np.uint8)
+    tworow = np.full((60, 80, 3), 255, dtype=np.uint8)
+    tworow[5:25, 5:75] = tworow[35:55, 5:75] = 0
+    ocr = RecordingOcr()
+    texts = worker.get_texts([wide, tworow], ocr)
+    assert ocr.detected == []
+    assert [len(text) for text in texts] == [1, 2]
+    assert all(reading[1][0] == 'REC' for text in texts for reading in text)
+
+
+def test_blank_crop_is_not_split():
+    assert worker.splitlines(np.zeros((40, 80, 3), dtype=np.uint8)) == [(0, 40)]
+
+
+def test_recognizer_without_read_fails_on_creation():
+    class Incomplete(worker.Recognizer):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
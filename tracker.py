@@ -0,0 +1,258 @@
+from dataclasses import dataclass, field
+from itertools import count
+from multiprocessing.managers import SyncManager
+import threading
+from time import time
+import numpy as np
+import cv2
+
+
+@dataclass
+class Track:
+    """A licence plate followed over consecutive frames of one camera
+    """
+    id: int
+    box: np.ndarray
+    first: float
+    last: float
+    hits: int = 1
+    reads: int = 0
+    best: float = 0.0
+    votes: dict = field(default_factory=dict)
+    decided: bool = False
+
+def iou(a:np.ndarray, b:np.ndarray):
+    """Intersection over union of two (ymin, xmin, ymax, xmax) boxes
+
+    Args:
+        a (np.ndarray): First box.
+        b (np.ndarray): Second box.
+
+    Returns:
+        float: IoU in [0, 1]
+    """
+    h = min(a[2], b[2]) - max(a[0], b[0])
+    w = min(a[3], b[3]) - max(a[1], b[1])
+    if h <= 0 or w <= 0:
+        return 0.0
+    inter = h * w
+    return inter / ((a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter)
+
+def centroid_distance(a:np.ndarray, b:np.ndarray):
+    """Distance between the centres of two (ymin, xmin, ymax, xmax) boxes
+
+    Args:
+        a (np.ndarray): First box.
+        b (np.ndarray): Second box.
+
+    Returns:
+        float: Euclidean distance in box units
+    """
+    return float(np.hypot((a[0] + a[2] - b[0] - b[2]) / 2, (a[1] + a[3] - b[1] - b[3]) / 2))
+
+def cropquality(img:np.ndarray, score:float):
+    """Quality of a plate crop for recognition, the detection score weighted by the sharpness of the crop
+
+    Args:
+        img (np.ndarray): Plate crop.
+        score (float): Detection score of the plate.
+
+    Returns:
+        float: Quality, higher is better
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    return float(score) * float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+class PlateTracker:
+    """IoU / centroid tracker of the licence plates seen by one camera.
+
+    Workers use it to recognize only the best crops of a plate, at most 'budget' of them.
+    The manager uses it to vote over the readings of a plate and decide once per track.
+    """
+    def __init__(self, iou_threshold:float=0.3, max_distance:float=0.1, max_gap:float=1.0, budget:int=3, min_votes:int=2):
+        """Initialize the tracker
+
+        Args:
+            iou_threshold (float, optional): Minimum IoU of a box with the last box of a track to continue it. Defaults to 0.3.
+            max_distance (float, optional): Maximum centroid distance (in normalized image units) to continue a track without the IoU overlap. Defaults to 0.1.
+            max_gap (float, optional): Seconds without a detection after which a track ends. Defaults to 1.0.
+            budget (int, optional): Maximum number of recognized crops per track. Defaults to 3.
+            min_votes (int, optional): Number of agreeing readings needed for a decision before the track ends. Defaults to 2.
+        """
+        self.iou_threshold = iou_threshold
+        self.max_distance = max_distance
+        self.max_gap = max_gap
+        self.budget = budget
+        self.min_votes = min_votes
+        self.tracks = []
+        self._ids = count()
+
+    @classmethod
+    def fromcfg(cls, cfg:dict):
+        """Create a tracker from the GENERAL config section
+
+        Args:
+            cfg (dict): GENERAL config section as a dictionary with the optional 'track_budget', 'track_votes', 'track_gap' and 'track_iou' keys.
+
+        Returns:
+            PlateTracker: The tracker, None if tracking is disabled with 'track_budget = 0'
+        """
+        budget = int(cfg.get('track_budget', 3))
+        if budget <= 0:
+            return None
+        return cls(iou_threshold=float(cfg.get('track_iou', 0.3)), max_gap=float(cfg.get('track_gap', 1.0)), budget=budget, min_votes=int(cfg.get('track_votes', 2)))
+
+    def update(self, boxes:list, now:float=None):
+        """Match detected boxes to the current tracks, starting new tracks for the unmatched ones
+
+        Args:
+            boxes (list): Normalized (ymin, xmin, ymax, xmax) boxes of one frame.
+            now (float, optional): Capture time of the frame. Defaults to the current time.
+
+        Returns:
+            list: The Track of every box
+        """
+        now = time() if now is None else now
+        boxes = [np.asarray(box, dtype=np.float64) for box in boxes]
+        # greedy matching, best overlapping pairs first
+        pairs = []
+        for i, box in enumerate(boxes):
+            for j, track in enumerate(self.tracks):
+                overlap = iou(box, track.box)
+                if overlap >= self.iou_threshold or centroid_distance(box, track.box) <= self.max_distance:
+                    pairs.append((overlap, -centroid_distance(box, track.box), i, j))
+        matched = [None] * len(boxes)
+        taken = set()
+        for *_, i, j in sorted(pairs, reverse=True):
+            if matched[i] is None and j not in taken:
+                matched[i] = self.tracks[j]
+                taken.add(j)
+        for i, box in enumerate(boxes):
+            if (track := matched[i]) is None:
+                track = matched[i] = Track(next(self._ids), box, now, now)
+                self.tracks.append(track)
+            else:
+                track.box = box
+                track.last = max(track.last, now)
+                track.hits += 1
+        return matched
+
+    def shouldread(self, track:Track, quality:float):
+        """Whether a crop should be recognized, true for the first crop of a track and for better ones while the budget lasts
+
+        Args:
+            track (Track): Track of the crop.
+            quality (float): Quality of the crop, see cropquality.
+
+        Returns:
+            bool: Recognize the crop
+        """
+        if track.reads >= self.budget or (track.reads and quality <= track.best):
+            return False
+        track.reads += 1
+        track.best = quality
+        return True
+
+    def vote(self, track:Track, text:str, conf:float):
+        """Add a reading of the plate to its track
+
+        Args:
+            track (Track): Track of the plate.
+            text (str): Recognized text.
+            conf (float): Recognition confidence.
+        """
+        if text:
+            votes, score = track.votes.get(text, (0, 0.0))
+            track.votes[text] = (votes + 1, score + float(conf))
+
+    def leader(self, track:Track):
+        """Get the reading with the most votes, ties are broken by the summed confidence
+
+        Args:
+            track (Track): Track of the plate.
+
+        Returns:
+            tuple: (text, mean confidence, number of votes), None if the track has no readings
+        """
+        if not track.votes:
+            return None
+        text, (votes, score) = max(track.votes.items(), key=lambda item: item[1])
+        return text, score / votes, votes
+
+    def decide(self, track:Track):
+        """Get the decision of a track once enough readings agree, at most once per track
+
+        Args:
+            track (Track): Track of the plate.
+
+        Returns:
+            tuple: (text, mean confidence), None if no decision is due
+        """
+        if track.decided or (leader := self.leader(track)) is None or leader[2] < self.min_votes:
+            return None
+        track.decided = True
+        return leader[:2]
+
+    def expire(self, now:float=None):
+        """Remove the tracks not seen for 'max_gap' seconds
+
+        Args:
+            now (float, optional): Current time. Defaults to the current time.
+
+        Returns:
+            list: (Track, decision) of the ended tracks, the decision is the leading reading of tracks which were not decided yet and None otherwise
+        """
+        now = time() if now is None else now
+        ended = [track for track in self.tracks if now - track.last > self.max_gap]
+        self.tracks = [track for track in self.tracks if now - track.last <= self.max_gap]
+        results = []
+        for track in ended:
+            decision = None
+            if not track.decided and (leader := self.leader(track)) is not None:
+                track.decided = True
+                decision = leader[:2]
+            results.append((track, decision))
+        return results
+
+
+class ReadGate:
+    """Plate trackers of all cameras deciding which plate crops the workers recognize.
+    Hosted by a TrackerManager and shared by all workers, so the read budget of a track holds however many workers see the plate.
+    """
+    def __init__(self, cfg:dict, num_cameras:int):
+        """Initialize the trackers
+
+        Args:
+            cfg (dict): Plate tracking config, see PlateTracker.fromcfg.
+            num_cameras (int): Number of cameras.
+        """
+        self.trackers = [PlateTracker.fromcfg(cfg) for _ in range(num_cameras)]
+        # the manager process serves every worker on its own thread
+        self._lock = threading.Lock()
+
+    def select(self, camid:int, boxes:list, qualities:list, now:float=None):
+        """Track the plates of a frame and decide for every crop whether to recognize it, see PlateTracker.shouldread
+
+        Args:
+            camid (int): Camera id.
+            boxes (list): Normalized (ymin, xmin, ymax, xmax) boxes of the plates.
+            qualities (list): Quality of every crop, see cropquality.
+            now (float, optional): Capture time of the frame. Defaults to the current time.
+
+        Returns:
+            list: Recognize the crop, for every crop
+        """
+        with self._lock:
+            if not 0 <= camid < len(self.trackers) or (camtracker := self.trackers[camid]) is None:
+                return [True] * len(boxes)
+            camtracker.expire(now)
+            tracks = camtracker.update(boxes, now)
+            return [camtracker.shouldread(track, quality) for track, quality in zip(tracks, qualities)]
+
+
+class TrackerManager(SyncManager):
+    """multiprocessing.Manager which can also host a ReadGate
+    """
+
+TrackerManager.register('ReadGate', ReadGate)
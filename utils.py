@@ -1,11 +1,11 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
+from configparser import ConfigParser
 from typing import Any
 from multiprocessing import Queue
 from PyQt5.QtWidgets import QTextEdit, QMdiSubWindow, QLabel
 from PyQt5 import Qt
 import PyQt5.QtGui as QtGui
 import PyQt5.QtCore as QtCore
-from tensorflow import keras, saved_model, convert_to_tensor, newaxis, lite
 from threading import Thread
 from logging.handlers import QueueHandler
 import logging
@@ -14,13 +14,63 @@ import cv2
 from time import time
 import sys
 
+import framebuffer
+from detectors import nms
 
-@dataclass
+
+# pipeline stages of a task in order, each one has a timestamp attribute on the task
+STAGES = ('captured', 'dispatched', 'dequeued', 'detected', 'recognized', 'decided')
+
+@dataclass(slots=True)
 class Task:
-    """Task utilized when transporting data between processes
+    """Task utilized when transporting data between processes.
+    Carries the per-camera frame sequence number and the time at which the frame passed each pipeline stage (0 if not reached).
     """
     id: int
     data: Any
+    seq: int = 0
+    captured: float = 0.0
+    dispatched: float = 0.0
+    dequeued: float = 0.0
+    detected: float = 0.0
+    recognized: float = 0.0
+    decided: float = 0.0
+    # normalized (ymin, xmin, ymax, xmax) boxes of the detected plates, one per plate reading in the result data, used for tracking
+    boxes: Any = None
+    # per plate reading, True if it was answered from the OCR cache instead of being recognized
+    cached: Any = None
+
+    def stamp(self, stage:str, at:float=None):
+        """Record the current time for a pipeline stage
+
+        Args:
+            stage (str): Stage name, one of STAGES.
+            at (float, optional): Time to record instead of the current time. Defaults to None.
+        """
+        setattr(self, stage, time() if at is None else at)
+
+    def reply(self, data):
+        """Create a task with new data, keeping the frame sequence number and timestamps
+
+        Args:
+            data (Any): New task data.
+
+        Returns:
+            Task: The new task
+        """
+        return replace(self, data=data)
+
+    def timings(self):
+        """Get the time spent between consecutive reached pipeline stages
+
+        Returns:
+            dict: Stage name to milliseconds since the previous reached stage, 'total' for the time since capture
+        """
+        reached = [(stage, getattr(self, stage)) for stage in STAGES if getattr(self, stage)]
+        timings = {stage:(t - prev) * 1000 for (_, prev), (stage, t) in zip(reached, reached[1:])}
+        if len(reached) > 1:
+            timings['total'] = (reached[-1][1] - reached[0][1]) * 1000
+        return timings
 
 # create a stream for the logger to output to the text box
 class LoggerOutput(QueueHandler):
@@ -49,75 +99,6 @@ class LoggerOutput(QueueHandler):
         """
         self.reciever_meta.invokeMethod(self.reciever, 'append', QtCore.Qt.ConnectionType.QueuedConnection, QtCore.Q_ARG(str, self.formatter.format(record)))
 
-class Detector:
-    """Wrapper detector class for the Tensorflow model
-    """
-    def __init__(self, path:str, *args, **kwargs):
-        """Initialize the class and load the model
-
-        Args:
-            path (str): Path to the model for license plate detection
-        """
-        try:
-            self.model = saved_model.load(path, *args, **kwargs)
-            self.wrappedmodel = keras.Sequential()
-            self.wrappedmodel.add(keras.layers.Lambda(lambda x: self.model(x)['detection_boxes']))
-        except OSError:
-            self.logger.error('Unable to load model')
-            self.model = lambda x:x
-            self.wrappedmodel = lambda x:x
-
-        self.wrappedmodel.compile()
-        self.wrappedmodel.stop_training = True
-
-    def __call__(self, img):
-        """Detect license plates in the image
-
-        Args:
-            img (np.ndarray): Image to be processed
-
-        Returns:
-            tensor: Tensor containing the bounding boxes of the detected license plates
-        """
-        image_np = np.array(img)
-        input_tensor = convert_to_tensor(image_np)
-        input_tensor = input_tensor[newaxis, ...]
-        detections = self.model(input_tensor)
-        return detections
-
-class LiteDetector(Detector):
-    def __init__(self, path: str, *args, **kwargs):
-        """Initialize the class and load the model
-
-        Args:
-            path (str): Path to the model for license plate detection
-        """
-        self.interpreter = lite.Interpreter(model_path=path)
-        self.interpreter.allocate_tensors()
-        self.input_details = self.interpreter.get_input_details()
-        self.output_details = self.interpreter.get_output_details()
-
-    def __call__(self, img):
-        """Detect license plates in the image
-
-        Args:
-            img (np.ndarray): Image to be processed
-
-        Returns:
-            tensor: Tensor containing the bounding boxes of the detected license plates
-        """
-        img = cv2.resize(img, (640, 640))
-        image_np = np.array(img)
-        image_np = (image_np / 255).astype(np.float32)
-        input_tensor = convert_to_tensor(image_np)
-        input_tensor = input_tensor[newaxis, ...]
-        self.interpreter.set_tensor(self.input_details[0]['index'], input_tensor)
-        self.interpreter.invoke()
-        conf = self.interpreter.get_tensor(self.output_details[0]['index'])
-        boxes = self.interpreter.get_tensor(self.output_details[1]['index'])
-        return {'detection_scores':conf, 'detection_boxes':boxes}
-
-
 class FeedManager:
     """Feed manager class for managing the live feeds
     """
@@ -163,7 +144,11 @@ class FeedManager:
             crop (bool): Enable camera image cropping feature
         """
         # re-implement the livefeed_thread function for linux (use qt as opencv-headless is not available)
-        cap = cv2.VideoCapture('{protocol}://{login}:{password}@{ip}:{port}'.format(**camcfg))
+        # read the frames the camera process already decodes instead of opening a second stream, if it is running
+        if camcfg.get('shm_name'):
+            cap = framebuffer.BufferCapture(camcfg['shm_name'])
+        if not camcfg.get('shm_name') or not cap.isOpened():
+            cap = cv2.VideoCapture('{protocol}://{login}:{password}@{ip}:{port}'.format(**camcfg))
         stream_ok = True
         frame_ok = True
         frameshape = cap.read().shape
@@ -260,26 +245,81 @@ class FeedManager:
         self.thread = None
 
 
-def crop_image(img, detections, threshold=0.5):
-    """Crops the image to the bounding box of the detected license plate.
+def getboolean(cfg:dict, key:str, fallback:bool=False):
+    """Read a boolean option of a config section passed as a dictionary, with the values accepted by ConfigParser.getboolean
+
+    Args:
+        cfg (dict): Config section as a dictionary.
+        key (str): Option name.
+        fallback (bool, optional): Value if the option is not set. Defaults to False.
+
+    Raises:
+        ValueError: The value is not a boolean
+
+    Returns:
+        bool: The value
+    """
+    value = cfg.get(key)
+    if value is None or isinstance(value, bool):
+        return fallback if value is None else value
+    if (state := str(value).strip().lower()) not in ConfigParser.BOOLEAN_STATES:
+        raise ValueError(f"Not a boolean: {key} = {value}")
+    return ConfigParser.BOOLEAN_STATES[state]
+
+def findplates(detections, threshold=0.5, top_k=5, nms_threshold=0.5):
+    """Get the detected license plates above the threshold, without duplicates, best first.
+
+    Args:
+        detections (dict): Detections containing the scores and bounding boxes of the detected license plates.
+        threshold (float, optional): Required threshold for the detection to pass. Defaults to 0.5.
+        top_k (int, optional): Maximum number of plates. Defaults to 5.
+        nms_threshold (float, optional): IoU above which overlapping detections of the same plate are suppressed. Defaults to 0.5.
+
+    Returns:
+        tuple: (K, 4) normalized (ymin, xmin, ymax, xmax) boxes and (K,) scores
+    """
+    scores = np.asarray(detections['detection_scores'][0], dtype=np.float32)
+    boxes = np.asarray(detections['detection_boxes'][0], dtype=np.float32).reshape(-1, 4)
+    passed = scores >= threshold
+    boxes, scores = boxes[passed], scores[passed]
+    keep = nms(boxes, scores, nms_threshold)[:top_k]
+    return boxes[keep], scores[keep]
+
+def crop_plates(img, detections, threshold=0.5, top_k=5, margin=0.1):
+    """Crops the image to the bounding boxes of all detected license plates.
 
     Args:
         img (np.ndarray): Image to be processed.
-        detections (Tensor): Tensor containing the bounding boxes of the detected license plates.
+        detections (dict): Detections containing the scores and bounding boxes of the detected license plates.
         threshold (float, optional): Required threshold for the detection to pass. Defaults to 0.5.
+        top_k (int, optional): Maximum number of plates. Defaults to 5.
+        margin (float, optional): Padding around every plate as a fraction of its width and height, so characters at the border are not cut. Defaults to 0.1.
 
     Returns:
-        np.ndarray: Cropped image
+        tuple: (crops, boxes, scores) of the plates, best first. Plates with an empty crop are left out
     """
-    boxes = detections['detection_boxes'][0]
-    scores = detections['detection_scores'][0]
+    boxes, scores = findplates(detections, threshold, top_k)
+    height, width = img.shape[:2]
+    pad = (boxes[:, 2:] - boxes[:, :2]) * margin
+    pixels = np.concatenate([boxes[:, :2] - pad, boxes[:, 2:] + pad], axis=1) * [height, width, height, width]
+    pixels = np.clip(np.round(pixels), 0, [height, width, height, width]).astype(int)
+    nonempty = (pixels[:, 2] > pixels[:, 0]) & (pixels[:, 3] > pixels[:, 1])
+    crops = [img[y1:y2, x1:x2] for y1, x1, y2, x2 in pixels[nonempty]]
+    return crops, boxes[nonempty], scores[nonempty]
 
-    max_score = max(enumerate(scores), key=lambda x:x[1])
-    if max_score[1] < threshold:
-        return None
-    ymin, xmin, ymax, xmax = boxes[max_score[0]]
-    x1, y1, x2, y2 = int(xmin * img.shape[1]), int(ymin * img.shape[0]), int(xmax * img.shape[1]), int(ymax * img.shape[0])
-    return img[y1:y2, x1:x2]
+def crop_image(img, detections, threshold=0.5):
+    """Crops the image to the bounding box of the detected license plate with the highest confidence.
+
+    Args:
+        img (np.ndarray): Image to be processed.
+        detections (dict): Detections containing the scores and bounding boxes of the detected license plates.
+        threshold (float, optional): Required threshold for the detection to pass. Defaults to 0.5.
+
+    Returns:
+        np.ndarray: Cropped image, None if no plate was detected
+    """
+    crops, _, _ = crop_plates(img, detections, threshold, top_k=1, margin=0)
+    return crops[0] if crops else None
 
 def joinpredictions(task:Task):
     """Joins the predictions of the task from list[bbox, (prediction, confidence))] to [bbox, prediction, confidence]
@@ -295,4 +335,4 @@ def joinpredictions(task:Task):
     text = ''.join([pred[1][0] for pred in task.data if pred[1][1] > 0.5])
     # calculate the bounding box of the license plate from the bounding boxes of the different predictions
     bbox = [min([pred[0][0] for pred in task.data]), min([pred[0][1] for pred in task.data]), max([pred[0][2] for pred in task.data]), max([pred[0][3] for pred in task.data])]
-    return Task(task.id, data=[bbox, (text, conf)])
+    return task.reply([bbox, (text, conf)])
@@ -4,28 +4,334 @@ import cv2
 import logging
 from logging.handlers import QueueHandler
 import traceback
-import paddleocr
 import os
-if __name__ == "__main__":
-    import time
+import importlib.util
+import time
+import abc
+from dataclasses import dataclass
 
-OCR = paddleocr.PaddleOCR(lang='en', use_angle_cls=False)
 SELFDIR = os.path.abspath(f'{__file__}/..')
+# plates read per frame of cameras without 'max_plates'
+MAX_PLATES = 5
+# plate crops at least this many times wider than high are read as a single line
+SINGLE_LINE_ASPECT = 2.5
+# ink of the gap between the lines of two row plates relative to the lines
+SPLIT_GAP = 0.25
+# minimum fraction of inked pixels in the fullest row of a text line
+MIN_LINE_INK = 0.05
+# seconds between the OCR cache statistics logs
+CACHE_STATS_INTERVAL = 60
+# characters of the CTC plate recognizer in the order of its output classes, the CTC blank is the class after the last character
+PLATE_ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
 
 import utils
+import detectors
+import framebuffer
+import tracker
+import ocrcache
+
+@dataclass
+class OcrConfig:
+    """Settings of the text recognizer of a worker, see the PaddleOCR documentation of the PaddleOCR options
+    """
+    # recognizer backend, see RECOGNIZERS
+    recognizer: str = 'paddle'
+    # model and characters of the 'ctc' backend
+    plate_model: str = f"{SELFDIR}/saved_model/plate_ocr.tflite"
+    plate_alphabet: str = PLATE_ALPHABET
+    lang: str = 'en'
+    use_angle_cls: bool = False
+    # text detector thresholds, only used for plates which are read with the text detector
+    det_db_thresh: float = 0.3
+    det_db_box_thresh: float = 0.6
+    drop_score: float = 0.5
+    # text lines per recognizer forward pass
+    rec_batch_num: int = 6
+    cpu_threads: int = 10
+    enable_mkldnn: bool = False
+
+    @classmethod
+    def fromcfg(cls, cfg:dict):
+        """Create the settings from the GENERAL config section
+
+        Args:
+            cfg (dict): GENERAL config section as a dictionary with the optional 'ocr_recognizer', 'plate_model', 'plate_alphabet', 'ocr_lang', 'ocr_det_thresh', 'ocr_box_thresh', 'ocr_drop_score', 'rec_batch_num', 'ocr_threads' and 'ocr_mkldnn' keys.
+
+        Returns:
+            OcrConfig: The settings
+        """
+        default = cls()
+        return cls(recognizer=cfg.get('ocr_recognizer', default.recognizer),
+                   plate_model=cfg.get('plate_model', default.plate_model),
+                   plate_alphabet=cfg.get('plate_alphabet', default.plate_alphabet),
+                   lang=cfg.get('ocr_lang', default.lang),
+                   det_db_thresh=float(cfg.get('ocr_det_thresh', default.det_db_thresh)),
+                   det_db_box_thresh=float(cfg.get('ocr_box_thresh', default.det_db_box_thresh)),
+                   drop_score=float(cfg.get('ocr_drop_score', default.drop_score)),
+                   rec_batch_num=int(cfg.get('rec_batch_num', 0)) or default.rec_batch_num,
+                   cpu_threads=int(cfg.get('ocr_threads', 0)) or default.cpu_threads,
+                   enable_mkldnn=utils.getboolean(cfg, 'ocr_mkldnn', default.enable_mkldnn))
+
+    def create(self):
+        """Load the PaddleOCR model, importing PaddleOCR
+
+        Returns:
+            paddleocr.PaddleOCR: The OCR model
+        """
+        import paddleocr
+        return paddleocr.PaddleOCR(lang=self.lang, use_angle_cls=self.use_angle_cls, det_db_thresh=self.det_db_thresh, det_db_box_thresh=self.det_db_box_thresh,
+                                   drop_score=self.drop_score, rec_batch_num=self.rec_batch_num, cpu_threads=self.cpu_threads, enable_mkldnn=self.enable_mkldnn, show_log=False)
+
+# OCR model of scripts using get_text directly, created on first use
+_ocr = None
+
+def default_ocr():
+    """Get the OCR model of the process with the default settings, loading it on first use
+
+    Returns:
+        paddleocr.PaddleOCR: The OCR model
+    """
+    global _ocr
+    if _ocr is None:
+        _ocr = OcrConfig().create()
+    return _ocr
+
+# recognizer backends by name, filled by 'register_recognizer'
+RECOGNIZERS = {}
+
+def register_recognizer(name:str):
+    """Class decorator adding a recognizer backend to RECOGNIZERS
+
+    Args:
+        name (str): Name of the backend, as used in the 'ocr_recognizer' config option.
+
+    Returns:
+        Callable: The decorator
+    """
+    def decorator(cls):
+        cls.name = name
+        RECOGNIZERS[name] = cls
+        return cls
+    return decorator
+
+def create_recognizer(config:OcrConfig=None):
+    """Create the recognizer backend selected in the settings
+
+    Args:
+        config (OcrConfig, optional): Recognizer settings. Defaults to OcrConfig().
+
+    Raises:
+        KeyError: Unknown backend
+
+    Returns:
+        Recognizer: The recognizer
+    """
+    config = config or OcrConfig()
+    return RECOGNIZERS[config.recognizer](config)
+
+class Recognizer(abc.ABC):
+    """Common interface of the recognizer backends.
+    'read' takes plate crops and returns the result of every crop in the format of get_text, a list of [bbox, (text, confidence)] per text line.
+    """
+    name = None
+    # top level modules needed by the backend
+    requires = ()
+
+    @classmethod
+    def installed(cls):
+        """Whether the runtime of the backend is installed"""
+        return all(importlib.util.find_spec(module) is not None for module in cls.requires)
+
+    @abc.abstractmethod
+    def read(self, imgs:list):
+        """Recognize plate crops
+
+        Args:
+            imgs (list): Plate crops.
+
+        Returns:
+            list: Extracted text of every crop in the format of get_text, in the order of the crops
+        """
+
+    def warmup(self):
+        """Recognize a blank line, so the first plate is not slowed down by lazy initialization
+        """
+        self.read([np.zeros((48, 160, 3), dtype=np.uint8)])
+
+@register_recognizer('paddle')
+class PaddleRecognizer(Recognizer):
+    """General purpose PaddleOCR recognizer, see get_texts
+    """
+    requires = ('paddleocr',)
+
+    def __init__(self, config:OcrConfig):
+        """Initialize the class and load the model
+
+        Args:
+            config (OcrConfig): PaddleOCR settings.
+        """
+        self.ocr = config.create()
+
+    def read(self, imgs:list):
+        return get_texts(imgs, self.ocr)
+
+    def warmup(self):
+        recognize([np.zeros((48, 160, 3), dtype=np.uint8)], self.ocr)
+
+@register_recognizer('ctc')
+class CtcRecognizer(Recognizer):
+    """Small plate specific CTC recognizer (e.g. a CRNN or LPRNet trained on plate crops) exported to TensorFlow Lite or ONNX.
+    The model takes (batch, height, width, channels) text line images, scaled to [0, 1] or raw 0-255 for uint8 inputs without quantization parameters,
+    and outputs (batch, time steps, len(alphabet) + 1) character probabilities or logits with the CTC blank as the last class.
+    The inputs and outputs of integer quantized lite models are quantized and dequantized with the scale and zero point of their tensors, see export.convert_recognizer.
+    Two row plates are split into lines like for PaddleOCR, there is no text detector.
+    """
+    @classmethod
+    def installed(cls):
+        return any(importlib.util.find_spec(module) is not None for module in ('tflite_runtime', 'tensorflow', 'onnxruntime'))
+
+    def __init__(self, config:OcrConfig):
+        """Initialize the class and load the model, '.onnx' models run on ONNX Runtime and all others on the TensorFlow Lite interpreter
+
+        Args:
+            config (OcrConfig): Settings with the 'plate_model' path, the 'plate_alphabet' and the 'cpu_threads'.
+        """
+        self.alphabet = config.plate_alphabet
+        self.session = self.interpreter = None
+        # (scale, zero point) of integer quantized lite model inputs and outputs
+        self.inputquant = self.outputquant = None
+        if config.plate_model.endswith('.onnx'):
+            import onnxruntime
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = config.cpu_threads
+            self.session = onnxruntime.InferenceSession(config.plate_model, options, providers=['CPUExecutionProvider'])
+            tensor = self.session.get_inputs()[0]
+            self.input = tensor.name
+            shape = tensor.shape
+            self.dtype = np.uint8 if tensor.type == 'tensor(uint8)' else np.float32
+            # symbolic batch dimension
+            self.dynamic = not isinstance(shape[0], int)
+        else:
+            Interpreter, *_ = detectors.load_tflite()
+            self.interpreter = Interpreter(model_path=config.plate_model, num_threads=config.cpu_threads)
+            self.interpreter.allocate_tensors()
+            tensor, output = self.interpreter.get_input_details()[0], self.interpreter.get_output_details()[0]
+            self.input, self.output = tensor['index'], output['index']
+            shape = tensor['shape']
+            self.dtype = tensor['dtype']
+            self.dynamic = False
+            if np.issubdtype(tensor['dtype'], np.integer) and tensor['quantization'][0]:
+                self.inputquant = tensor['quantization']
+            if np.issubdtype(output['dtype'], np.integer) and output['quantization'][0]:
+                self.outputquant = output['quantization']
+        self.height, self.width, self.channels = (int(size) for size in shape[1:4])
+
+    def read(self, imgs:list):
+        # (image index, top, bottom) of every text line to recognize
+        lines = []
+        for i, img in enumerate(imgs):
+            height, width = np.shape(img)[:2]
+            split = [(0, height)] if width >= SINGLE_LINE_ASPECT * height else splitlines(np.asarray(img))
+            lines += [(i, y1, y2) for y1, y2 in split]
+        results = [[] for _ in imgs]
+        if not lines:
+            return results
+        scores = self._run(np.stack([self.preprocess(np.asarray(imgs[i])[y1:y2]) for i, y1, y2 in lines]))
+        for (i, y1, y2), line in zip(lines, scores):
+            width = np.shape(imgs[i])[1]
+            results[i] += cleantext([[[[0, y1], [width, y1], [width, y2], [0, y2]], self.decode(line)]])
+        return results
+
+    def preprocess(self, img:np.ndarray):
+        """Resize a text line to the model input
+
+        Args:
+            img (np.ndarray): Text line image.
+
+        Returns:
+            np.ndarray: (height, width, channels) input of the model input type
+        """
+        img = cv2.resize(img, (self.width, self.height), interpolation=cv2.INTER_AREA)
+        if self.channels == 1:
+            img = (cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img)[..., np.newaxis]
+        elif img.ndim == 2:
+            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        if self.inputquant is not None:
+            scale, zero = self.inputquant
+            limits = np.iinfo(self.dtype)
+            return np.clip(np.round(img / (255 * scale) + zero), limits.min, limits.max).astype(self.dtype)
+        return img if self.dtype == np.uint8 else img.astype(np.float32) / 255
+
+    def _run(self, inputs:np.ndarray):
+        """Run the model on a stacked batch of text lines, one line at a time if the batch size of the model is fixed
+
+        Args:
+            inputs (np.ndarray): (lines, height, width, channels) inputs.
+
+        Returns:
+            np.ndarray: (lines, time steps, classes) scores, dequantized for quantized outputs
+        """
+        if self.session is not None:
+            if self.dynamic:
+                return self.session.run(None, {self.input:inputs})[0]
+            return np.concatenate([self.session.run(None, {self.input:inputs[i:i + 1]})[0] for i in range(len(inputs))])
+        outputs = []
+        for i in range(len(inputs)):
+            self.interpreter.set_tensor(self.input, inputs[i:i + 1])
+            self.interpreter.invoke()
+            outputs.append(self.interpreter.get_tensor(self.output))
+        if self.outputquant is None:
+            return np.concatenate(outputs)
+        scale, zero = self.outputquant
+        return (np.concatenate(outputs).astype(np.float32) - zero) * scale
+
+    def decode(self, scores:np.ndarray):
+        """Greedy CTC decoding, the best class of every time step with repeats collapsed and blanks removed
+
+        Args:
+            scores (np.ndarray): (time steps, classes) probabilities or logits of one text line.
+
+        Returns:
+            tuple: (text, confidence), the confidence is the mean probability of the decoded characters
+        """
+        scores = np.asarray(scores, dtype=np.float32)
+        if scores.min() < 0 or not np.allclose(scores.sum(axis=-1), 1, atol=1e-2):
+            scores = np.exp(scores - scores.max(axis=-1, keepdims=True))
+            scores /= scores.sum(axis=-1, keepdims=True)
+        best = scores.argmax(axis=-1)
+        keep = best != scores.shape[-1] - 1
+        keep[1:] &= best[1:] != best[:-1]
+        text = ''.join(self.alphabet[k] for k in best[keep] if k < len(self.alphabet))
+        conf = float(scores.max(axis=-1)[keep].mean()) if keep.any() else 0.0
+        return text, conf
 
 class Worker:
-    """A worker class to process tasks from a queue and put the results in another queue
+    """A worker class pulling frames from the camera ready set and putting the results in a queue
     """
-    def __init__(self, qrecv:Queue, qsend:Queue, loggerQueue=Queue(), *_, model_type='lite', model_pth=None, autostart=False, **__) -> None:
+    def __init__(self, qrecv:framebuffer.ReadySet, qsend:Queue, loggerQueue=Queue(), *_, model_type='lite', model_pth=None, autostart=False, active=None, ready=None, retire=None, batch_size=1, batch_wait=0.0, tracking:dict=None, gate=None, heartbeat=None, busy=None, num_threads:int=None, delegate:str='xnnpack', cameras:list=None, ocr_config=None, ocr_cache:dict=None, shared_cache=None, **__) -> None:
         """Initialize the worker
 
         Args:
-            qrecv (Queue): Receiver queue for communication.
-            qsend (Queue): Transmitter queue for communication.
+            qrecv (framebuffer.ReadySet): Ready set of the camera frame buffers to pull frames from.
+            qsend (Queue): Result queue shared by all workers.
             loggerQueue (Queue, optional): Queue for logging connections. Defaults to multiprocessing.Queue().
-            detector (utils.Detector, optional): Licence Plate detector class. Defaults to utils.Detector(f'{__file__}\..\saved_model\saved_model').
+            model_type (str, optional): Detector backend, see detectors.create. Defaults to 'lite'.
             autostart (bool, optional): Automatically start the main loop, if set to false, the 'run' method needs to be called separately. Defaults to False.
+            active (mp.Event, optional): The worker only takes frames while set, a parked worker keeps its models loaded as a spare. Always active if None. Defaults to None.
+            ready (mp.Event, optional): Set once the models are loaded and the main loop started. Defaults to None.
+            retire (mp.Event, optional): The main loop exits after the current frame once set. Defaults to None.
+            batch_size (int, optional): Maximum number of frames claimed and detected together. Defaults to 1.
+            batch_wait (float, optional): Seconds to wait for more frames after the first frame of a batch. Defaults to 0.
+            tracking (dict, optional): Plate tracking config of trackers private to this worker, see tracker.PlateTracker.fromcfg. Every crop is recognized if None and no gate is set. Defaults to None.
+            gate (tracker.ReadGate, optional): Proxy of the read gate shared by all workers, takes the place of 'tracking', so the read budget of a track holds across workers. Defaults to None.
+            heartbeat (mp.Value, optional): Shared double set to the current time on every main loop iteration. Defaults to None.
+            busy (mp.Value, optional): Shared double set to the dispatch time of the batch being processed, 0 while idle. Defaults to None.
+            num_threads (int, optional): Interpreter threads of the lite model. Defaults to None.
+            delegate (str, optional): Delegate of the lite model, see detectors.LiteDetector. Defaults to 'xnnpack'.
+            cameras (list, optional): Camera configs as dictionaries by camera id, for the regions of interest and tiling, see detectors.RegionDetector.fromcfg. Whole frames are detected if None. Defaults to None.
+            ocr_config (OcrConfig, optional): Settings of the recognizer, which is loaded here in the worker process. Defaults to OcrConfig().
+            ocr_cache (dict, optional): OCR cache config, see ocrcache.OcrCache.fromcfg. Every crop is recognized if None. Defaults to None.
+            shared_cache (dict, optional): OCR cache entries shared by the workers, e.g. a multiprocessing.Manager().dict(). Defaults to None.
         """
         self.logger = logging.getLogger()
         self.logger.setLevel(logging.INFO)
@@ -38,70 +344,337 @@ class Worker:
             pth = model_pth
 
         # setup detection model
-        if model_type == 'tf':
-            self.logger.info("Using TensorFlow model")
-            self.detector = utils.Detector(f"{pth}/saved_model")
-        elif model_type == 'lite':
-            self.logger.info("Using TensorFlow Lite model")
-            self.detector = utils.LiteDetector(f"{pth}/model.tflite")
-        else:
-            self.logger.error("Invalid model type")
+        self.logger.info(f"Using {model_type} detector")
+        try:
+            self.detector = detectors.create(model_type, pth, num_threads=num_threads, delegate=delegate)
+        except KeyError:
+            self.logger.error(f"Invalid model type {model_type}, installed backends with a model: {', '.join(detectors.available(pth)) or 'none'}")
+            exit(1)
+        # the OCR model is only loaded in the worker processes, never on import
+        ocr_config = ocr_config or OcrConfig()
+        self.logger.info(f"Using {ocr_config.recognizer} recognizer")
+        try:
+            self.recognizer = create_recognizer(ocr_config)
+        except KeyError:
+            self.logger.error("Invalid recognizer")
             exit(1)
 
         self._Qrecv = qrecv
         self._Qsend = qsend
+        self._active = active
+        self._ready = ready
+        self._retire = retire
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait
+        self.tracking = tracking
+        self.gate = gate
+        # per camera plate trackers, None for cameras without tracking
+        self.trackers = {}
+        self.cameras = cameras or []
+        # per camera detection front-ends
+        self.regions = {}
+        self._heartbeat = heartbeat
+        self._busy = busy
+        # near-duplicate plate crops get the reading of the last recognized one
+        self.cache = ocrcache.OcrCache.fromcfg(ocr_cache, shared_cache) if ocr_cache is not None else None
+        self.nextstats = time.time() + CACHE_STATS_INTERVAL
+        self.warmup()
         if autostart: self.run()
 
+    def nextbatch(self, timeout:float=None):
+        """Claim a micro-batch of up to 'batch_size' frames, waiting at most 'batch_wait' seconds after the first one
+
+        Args:
+            timeout (float, optional): Seconds to wait for the first frame. Waits indefinitely if None. Defaults to None.
+
+        Returns:
+            list: Tasks referencing the claimed frames, empty on timeout
+        """
+        tasks = [utils.Task(camid, ref, seq=ref.seq, captured=ref.timestamp) for camid, ref in self._Qrecv.claimbatch(self.batch_size, self.batch_wait, timeout)]
+        # the frames of a batch share the dispatch time, which lets the manager tell batches apart
+        for task in tasks:
+            task.stamp('dispatched', at=tasks[0].dispatched or None)
+        return tasks
+
+    def getframe(self, task:utils.Task):
+        """Get the frame of a task, reading it from the camera frame buffer if needed
+
+        Args:
+            task (utils.Task): Task containing either a framebuffer.FrameRef or the frame itself.
+
+        Returns:
+            np.ndarray: The frame, None if it was overwritten before the worker got to it
+        """
+        if not isinstance(task.data, framebuffer.FrameRef):
+            return task.data
+        result = self._Qrecv.read(task.data)
+        if result is None:
+            self.logger.debug(f"Frame {task.data.seq} of camera {task.id} was overwritten, skipping")
+            return None
+        return result[0]
+
+    def region(self, camid:int):
+        """Get the detection front-end of a camera
+
+        Args:
+            camid (int): Camera id.
+
+        Returns:
+            detectors.RegionDetector: The front-end
+        """
+        if camid not in self.regions:
+            self.regions[camid] = detectors.RegionDetector.fromcfg(self.detector, self.cameras[camid] if camid < len(self.cameras) else {})
+        return self.regions[camid]
+
+    def warmup(self):
+        """Run the detector on blank inputs of every shape the cameras will produce and the recognizer on a blank line, the worker only reports ready afterwards
+        """
+        shapes = sorted({shape for camid in range(max(1, len(self.cameras))) for shape in self.region(camid).inputshapes()})
+        if not shapes and not self.detector.resizes:
+            self.logger.warning(f"The input shapes of the {self.detector.name} detector are unknown, the first frame of every camera pays for tracing it. Set the 'resolution' of the cameras or turn 'letterbox' on")
+        start = time.perf_counter()
+        self.detector.warmup(shapes)
+        self.recognizer.warmup()
+        warmed = len(shapes) or (1 if self.detector.resizes else 0)
+        self.logger.info(f"Warmed up the detector for {warmed} input shape(s) and the recognizer in {time.perf_counter() - start:.1f} s")
+
+    def detect(self, tasks:list, frames:list):
+        """Detect license plates in the frames of a batch, the regions and tiles of all frames are detected with one detector call
+
+        Args:
+            tasks (list): Tasks of the frames.
+            frames (list): The frames.
+
+        Returns:
+            list: Detections of every frame in full frame coordinates
+        """
+        return detectors.detectregions(self.detector, [self.region(task.id) for task in tasks], frames)
+
+    def beat(self, busy:float=0.0):
+        """Update the heartbeat watched by the manager
+
+        Args:
+            busy (float, optional): Dispatch time of the batch being processed, 0 while idle. Defaults to 0.
+        """
+        if self._heartbeat is not None:
+            self._heartbeat.value = time.time()
+        if self._busy is not None:
+            self._busy.value = busy
+
+    def shouldread(self, task:utils.Task, crops:list, scores:list):
+        """Whether to recognize the plate crops of a frame, only the best crops of every tracked plate are recognized
+
+        Args:
+            task (utils.Task): Task of the frame, with the boxes of the plates set.
+            crops (list): Plate crops.
+            scores (list): Detection scores of the plates.
+
+        Returns:
+            list: Recognize the crop, for every crop
+        """
+        if self.gate is not None:
+            # one round trip to the manager per frame
+            return self.gate.select(task.id, task.boxes, [tracker.cropquality(crop, score) for crop, score in zip(crops, scores)], task.captured)
+        if task.id not in self.trackers:
+            self.trackers[task.id] = tracker.PlateTracker.fromcfg(self.tracking) if self.tracking is not None else None
+        if (camtracker := self.trackers[task.id]) is None:
+            return [True] * len(crops)
+        camtracker.expire(task.captured)
+        tracks = camtracker.update(task.boxes, task.captured)
+        return [camtracker.shouldread(track, tracker.cropquality(crop, score)) for track, crop, score in zip(tracks, crops, scores)]
+
+    def read(self, tasks:list, pending:list):
+        """Recognize plate crops, near-duplicates of recently recognized crops of the same camera are answered from the OCR cache
+
+        Args:
+            tasks (list): Tasks of the batch.
+            pending (list): (task index, plate index, crop) of the crops to recognize.
+
+        Returns:
+            tuple: (results, cached), the OCR result of every crop in the format of get_text and whether it came from the cache
+        """
+        if self.cache is None:
+            return self.recognizer.read([crop for *_, crop in pending]), [False] * len(pending)
+        keys = [ocrcache.phash(crop) for *_, crop in pending]
+        results = [self.cache.get(tasks[i].id, key) for (i, *_), key in zip(pending, keys)]
+        cached = [result is not None for result in results]
+        missed = [k for k, result in enumerate(results) if result is None]
+        for k, text in zip(missed, self.recognizer.read([pending[k][2] for k in missed])):
+            results[k] = text
+            self.cache.put(tasks[pending[k][0]].id, keys[k], text)
+        return results, cached
+
+    def logstats(self):
+        """Log the OCR cache hit rate every CACHE_STATS_INTERVAL seconds
+        """
+        if self.cache is None or time.time() < self.nextstats:
+            return
+        self.nextstats = time.time() + CACHE_STATS_INTERVAL
+        stats = self.cache.stats()
+        self.logger.info(f"OCR cache: {stats['hits']} hit(s), {stats['misses']} miss(es), hit rate {stats['hitrate']:.0%}, {stats['size']} entries")
+
+    def maxplates(self, camid:int):
+        """Get the maximum number of plates read per frame of a camera, the 'max_plates' camera config key
+
+        Args:
+            camid (int): Camera id.
+
+        Returns:
+            int: Maximum number of plates
+        """
+        return int((self.cameras[camid] if camid < len(self.cameras) else {}).get('max_plates') or MAX_PLATES)
+
     def run(self):
         """Main loop of the worker.
         """
         self.logger.info("Worker started")
-        while True:
-            text = []
+        self.beat()
+        if self._ready is not None:
+            self._ready.set()
+        while self._retire is None or not self._retire.is_set():
+            tasks = []
+            texts = {}
+            self.beat()
+            self.logstats()
             try:
-                task:utils.Task = self._Qrecv.get()
-                if task.data is not None:
-                    detections = self.detector(task.data)
-                    img = utils.crop_image(task.data, detections, threshold=0.2)
-                    if img is not None and len(img) > 0:
-                        #imgmean = np.mean(img)
-                        #_, img = cv2.threshold(img, imgmean, 255, cv2.THRESH_BINARY)
-                        #cv2.imshow("img", img)
-                        #cv2.waitKey(1)
-                        text = get_text(img)
+                # parked spares do not take frames, the timeouts make them notice retirement
+                if self._active is not None and not self._active.wait(timeout=1):
+                    continue
+                if not (tasks := self.nextbatch(timeout=1)):
+                    continue
+                self.beat(tasks[0].dispatched)
+                frames = []
+                for task in tasks:
+                    frames.append(self.getframe(task))
+                    task.stamp('dequeued')
+                # frames overwritten before the worker got to them are answered with an empty result
+                valid = [i for i, frame in enumerate(frames) if frame is not None]
+                detections = self.detect([tasks[i] for i in valid], [frames[i] for i in valid]) if valid else []
+                # the plate crops of the whole batch are recognized together
+                pending = []
+                for i, detection in zip(valid, detections):
+                    tasks[i].stamp('detected')
+                    crops, boxes, scores = utils.crop_plates(frames[i], detection, threshold=0.2, top_k=self.maxplates(tasks[i].id))
+                    tasks[i].boxes = list(boxes)
+                    tasks[i].cached = [False] * len(crops)
+                    texts[i] = [[] for _ in crops]
+                    pending += [(i, j, crops[j]) for j, read in enumerate(self.shouldread(tasks[i], crops, scores)) if read]
+                results, cached = self.read(tasks, pending)
+                for (i, j, _), text, hit in zip(pending, results, cached):
+                    texts[i][j] = text
+                    tasks[i].cached[j] = hit
+                for i in {i for i, *_ in pending}:
+                    tasks[i].stamp('recognized')
             except Exception as e:
-                self.logger.error(f"Exception in worker:")
+                self.logger.error("Exception in worker:")
                 self.logger.error(traceback.format_exc())
                 if type(e) == KeyboardInterrupt:
                     break
-            self._Qsend.put(utils.Task(id=task.id, data=text))
+            for i, task in enumerate(tasks):
+                self._Qsend.put(task.reply(texts.get(i, [])))
+
+def get_texts(imgs:list, ocr=None, det=False):
+    """Get text from several plate crops, the text lines of all crops are recognized with one batched recognizer call.
+    Crops which need the text detector (see get_text) are read one at a time.
+
+    Args:
+        imgs (list): Images for text extraction
+        ocr (paddleocr.PaddleOCR, optional): OCR model for detection. Defaults to default_ocr().
+        det (bool, optional): Always run the text detector before the recognizer. Defaults to False.
+
+    Returns:
+        list: Extracted text of every image in the format of get_text, in the order of the images
+    """
+    ocr = ocr or default_ocr()
+    results = [None] * len(imgs)
+    # (image index, top, bottom) of every text line to recognize
+    lines = []
+    for i, img in enumerate(imgs):
+        img = np.asarray(img)
+        height, width = img.shape[:2]
+        split = [(0, height)] if width >= SINGLE_LINE_ASPECT * height else splitlines(img)
+        # near-square crops without two clear lines would be squashed into a single line
+        if det or (width < SINGLE_LINE_ASPECT * height and len(split) == 1):
+            results[i] = cleantext(ocr.ocr(img, cls=False)[0] or [])
+        else:
+            results[i] = []
+            lines += [(i, y1, y2) for y1, y2 in split]
+    for (i, y1, y2), (text, conf) in zip(lines, recognize([np.asarray(imgs[i])[y1:y2] for i, y1, y2 in lines], ocr)):
+        width = np.shape(imgs[i])[1]
+        results[i] += cleantext([[[[0, y1], [width, y1], [width, y2], [0, y2]], (text, conf)]])
+    return results
 
-def get_text(img, ocr=OCR):
+def get_text(img, ocr=None, det=False):
     """Get text from an image.
+    Plate crops are already localised, so by default only the text recognizer runs: on the whole crop for single line plates and on every line of two row plates.
+    The text detector only runs for crops which are not wide enough for a single line and could not be split into lines.
 
     Args:
         img (numpy.ndarray): Image for text extraction
-        ocr (paddleocr.PaddleOCR, optional): OCR model for detection. Defaults to OCR.
+        ocr (paddleocr.PaddleOCR, optional): OCR model for detection. Defaults to default_ocr().
+        det (bool, optional): Always run the text detector before the recognizer. Defaults to False.
 
     Returns:
         list: Extracted text with bbox and confidence
     """
-    img = np.asarray(img)
-    result = ocr.ocr(img, cls=False)
-    result = result[0]
-    # clean up the result
-    # make sure the text only contains alphanumeric characters
+    return get_texts([img], ocr, det)[0]
+
+def recognize(imgs:list, ocr=None):
+    """Recognize single text lines in one call of the recognizer, which resizes them to its input height, pads and normalizes them and runs them in batches of 'rec_batch_num'
+
+    Args:
+        imgs (list): Text line images.
+        ocr (paddleocr.PaddleOCR, optional): OCR model for recognition. Defaults to default_ocr().
+
+    Returns:
+        list: (text, confidence) of every image, in the order of the images
+    """
+    if not imgs:
+        return []
+    results, _ = (ocr or default_ocr()).text_recognizer(list(imgs))
+    return results
+
+def cleantext(result:list):
+    """Clean up an OCR result, making sure the text only contains alphanumeric characters
+
+    Args:
+        result (list): OCR result in the format [bbox, (text, confidence)].
+
+    Returns:
+        list: The cleaned result
+    """
     # result format: [bbox, (text, confidence)]
-    for i in range(len(result)):
-        result[i] = [result[i][0], (''.join([c for c in result[i][1][0] if c.isalnum()]), result[i][1][1])]
-    # result[1] = (''.join([c for c in result[1][0] if c.isalnum()]), result[1][1])
+    return [[bbox, (''.join([c for c in text if c.isalnum()]), conf)] for bbox, (text, conf) in result]
 
-    return result
+def splitlines(img:np.ndarray):
+    """Split a plate crop into its text lines at the row with the least ink near the middle
 
+    Args:
+        img (np.ndarray): Plate crop.
+
+    Returns:
+        list: (top, bottom) rows of the lines, a single line if the crop has no clear gap between two inked lines
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    height = gray.shape[0]
+    if height < 8:
+        return [(0, height)]
+    _, binary = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # the characters are the minority of the pixels, dark on bright or bright on dark
+    if binary.mean() > 0.5:
+        binary = 1 - binary
+    profile = binary.mean(axis=1)
+    low, high = int(height * 0.3), int(height * 0.7)
+    row = low + int(np.argmin(profile[low:high]))
+    ink = min(profile[:row].max(), profile[row:].max())
+    # a gap between two lines has far less ink than both lines, blank or low contrast crops have no lines to split
+    if ink < MIN_LINE_INK or profile[row] > SPLIT_GAP * ink:
+        return [(0, height)]
+    return [(0, row), (row, height)]
 
 if __name__ == '__main__':
     print("-------------------")
-    detector = utils.Detector(f'{SELFDIR}/saved_model/saved_model')
+    detector = detectors.Detector(f'{SELFDIR}/saved_model/saved_model')
 
     img = cv2.imread(f"{SELFDIR}/LP_Detection/train/1af54be605a0f1d5_jpg.rf.34325727380de220fcd244b900430c97.jpg")
     # img = cv2.imread(f"{SELFDIR}/test17.jpg")